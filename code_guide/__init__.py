@@ -1,32 +1,137 @@
 #!/usr/bin/env python
 
+__version__ = "1.0.2"
+
 import sys
+import io
 import re
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
 from operator import itemgetter as item
 from itertools import groupby, islice
-import argparse
+from array import array
 import os
+import tempfile
+import hashlib
+import json
+import pkgutil
+from fnmatch import fnmatch
+import threading
+import time
 from shutil import copyfileobj
 import urllib
-from pkg_resources import resource_listdir, resource_isdir, resource_stream
 import xml.sax
 from xml.sax.saxutils import XMLGenerator, XMLFilterBase
 from xml.etree.ElementTree import fromstring as etree_from_string
-import markdown
-import pygments
-import pygments.lexers
-from pygments.formatters import HtmlFormatter
 
-_parsed_line = namedtuple('_parsed_line', ['group_fn', 'line', 'parts'])
+# Markdown, Pygments, argparse and multiprocessing are imported by the 
+# functions that use them, so that the command line starts quickly when 
+# it does not need them, as when it is only asked to extract resources.
+
+_parsed_line = namedtuple('_parsed_line', ['group_fn', 'line', 'parts', 'lineno'])
 
-_root = namedtuple('root', ['children', 'intro', 'outro'])
-_explanation = namedtuple('explanation', ['text', 'index', 'children'])
-line = namedtuple('line', ['text'])
-_intro = namedtuple('intro', ['text'])
+from code_guide.events import root as _root, explanation as _explanation, line, intro as _intro, \
+    start as _start, end as _end, region
 
-_start = namedtuple('_start', ['text', 'index'])
-_end = namedtuple('_end', [])
+
+class MarkupError(ValueError):
+    """Reports badly formed markup, such as unbalanced region start and end comments"""
+    
+    def __init__(self, lineno, description, source=None):
+        ValueError.__init__(self, lineno, description, source)
+        self.lineno = lineno
+        self.description = description
+        self.source = source
+    
+    def __str__(self):
+        location = "line %s" % self.lineno if self.source is None else "%s:%s" % (self.source, self.lineno)
+        return location + ": " + self.description
+
+
+class Profile(object):
+    """The time spent in each stage of converting guides, in seconds, and counts of the work done"""
+    
+    def __init__(self, times=None, counts=None):
+        self.times = dict(times or {})
+        self.counts = dict(counts or {})
+    
+    def add_time(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+    
+    def count(self, counter, n=1):
+        self.counts[counter] = self.counts.get(counter, 0) + n
+    
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.time() - start)
+    
+    def timed(self, stage, iterable):
+        """Yields the items of iterable, adding the time taken to produce them to stage"""
+        it = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                x = next(it)
+            finally:
+                self.add_time(stage, time.time() - start)
+            yield x
+    
+    def add(self, other):
+        for stage, seconds in other.times.items():
+            self.add_time(stage, seconds)
+        for counter, n in other.counts.items():
+            self.count(counter, n)
+        return self
+    
+    def as_dict(self):
+        return {"times": dict(self.times), "counts": dict(self.counts)}
+    
+    def summary(self):
+        return "".join(
+            ["%-24s %10.3fs\n" % (stage, seconds) for stage, seconds in sorted(self.times.items())] + 
+            ["%-24s %11d\n" % (counter, n) for counter, n in sorted(self.counts.items())])
+
+
+class _NullProfile(object):
+    """Stands in for a Profile when none is given, and records nothing"""
+    
+    def add_time(self, stage, seconds):
+        pass
+    
+    def count(self, counter, n=1):
+        pass
+    
+    def timer(self, stage):
+        return _null_timer
+    
+    def timed(self, stage, iterable):
+        return iterable
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+    
+    def __exit__(self, *exc_info):
+        return False
+
+_null_timer = _NullTimer()
+_no_profile = _NullProfile()
+
+
+def counted_events(events, profile):
+    """Yields events, counting the lines and regions among them"""
+    for e in events:
+        t = type(e)
+        if t == line:
+            profile.count("lines")
+        elif t == _start:
+            profile.count("regions")
+        yield e
 
 
 
@@ -39,15 +144,16 @@ def _start_index(line):
 
 
 def _intro_group(lines):
-    yield _intro(_join_text(lines))
+    lines = list(lines)
+    yield _intro(_join_text(lines), lineno=lines[0].lineno)
 
 def _start_group(lines):
     lines = list(lines)
-    yield _start(index=_start_index(lines[0]), text=_join_text(lines))
+    yield _start(index=_start_index(lines[0]), text=_join_text(lines), lineno=lines[0].lineno)
 
 def _end_group(lines):
     for l in lines:
-        yield _end()
+        yield _end(lineno=l.lineno)
 
 def _line_group(lines):
     for l in lines:
@@ -55,62 +161,288 @@ def _line_group(lines):
 
 
 
-def _parse_lines(lines, comment_start):
-    comment_start_re = re.escape(comment_start)
-    intro_pattern = re.compile(r'^\s*' + comment_start_re + '\|\|(\s*| (?P<text>.+?))$')
-    region_start_pattern = re.compile(r'^\s*' + comment_start_re + '\|(( \[(?P<index>[0-9]+)\]\s*)? (?P<text>.*?))?$')
-    region_end_pattern = re.compile(r'^\s*' + comment_start_re + '\|\.\s*$')
-    
-    # The order in which these patterns are checked is important to avoid ambiguity.
-    _line_groups = [
-        (intro_pattern, _intro_group),
-        (region_end_pattern, _end_group),
-        (region_start_pattern, _start_group)]
-    
-    def _parse_line(l):
-        for pattern, group_fn in _line_groups:
-            m = pattern.match(l)
-            if m is not None:
-                return _parsed_line(group_fn, l, m.groupdict())
+_classifiers = {}
+
+def _line_classifier(comment_start):
+    """Returns a function that parses a line into a _parsed_line, compiled once per comment_start"""
+    try:
+        return _classifiers[comment_start]
+    except KeyError:
+        pass
+    
+    marker = comment_start + "|"
+    
+    # The order of the alternatives is important to avoid ambiguity.
+    pattern = re.compile(r'^\s*' + re.escape(comment_start) + r'\|(?:'
+                         r'(?P<intro>\|)(?:\s*| (?P<intro_text>.+?))|'
+                         r'(?P<end>\.)\s*|'
+                         r'(?:( \[(?P<index>[0-9]+)\]\s*)? (?P<text>.*?))?'
+                         r')$')
+    
+    def classify(l, lineno):
+        if marker not in l:
+            return _parsed_line(_line_group, l, {}, lineno)
+        
+        m = pattern.match(l)
+        if m is None:
+            return _parsed_line(_line_group, l, {}, lineno)
+        elif m.group('intro') is not None:
+            return _parsed_line(_intro_group, l, {'text': m.group('intro_text')}, lineno)
+        elif m.group('end') is not None:
+            return _parsed_line(_end_group, l, {}, lineno)
         else:
-            return _parsed_line(_line_group, l, {})
+            return _parsed_line(_start_group, l, {'index': m.group('index'), 'text': m.group('text')}, lineno)
     
-    return (_parse_line(l) for l in lines)
+    _classifiers[comment_start] = classify
+    return classify
+
+def _parse_lines(lines, comment_start):
+    classify = _line_classifier(comment_start)
+    return (classify(l, lineno) for lineno, l in enumerate(lines, 1))
 
 def _delimited(parsed_lines):
     for group_fn, group_lines in groupby(parsed_lines, item(0)):
         for e in group_fn(group_lines):
             yield e
 
-def _to_tree(delimited_lines):
+def _to_tree(delimited_lines, regions=None):
+    """Nests the lines between start and end events into explanations, adding each region to regions"""
+    top = []
+    children = top
+    open_regions = []
+    
     for e in delimited_lines:
         t = type(e)
         if t == _start:
-            yield _explanation(text=e.text, index=e.index, children=list(_to_tree(delimited_lines)))
+            if regions is None:
+                open_regions.append((e, children, None))
+            else:
+                open_regions.append((e, children, len(regions)))
+                regions.append(None)
+            children = []
         elif t == _end:
-            return
+            if not open_regions:
+                raise MarkupError(e.lineno, "end of region that has not been started")
+            start, parent, n = open_regions.pop()
+            parent.append(_explanation(text=start.text, index=start.index, children=children))
+            children = parent
+            if regions is not None:
+                regions[n] = region(ordinal=n + 1, index=start.index, text=start.text, start=start.lineno, end=e.lineno,
+                                    depth=len(open_regions), parent=open_regions[-1][2] + 1 if open_regions else None)
+        elif t == _intro and open_regions:
+            raise MarkupError(e.lineno, "introduction inside a region")
         else:
-            yield e
+            children.append(e)
+    
+    if open_regions:
+        raise MarkupError(open_regions[-1][0].lineno, "region is not ended")
+    
+    return top
 
 
-def lines_to_tagged_tree(lines, comment_start="#"):
-    parse = list(_to_tree(_delimited(_parse_lines(lines, comment_start))))
-    children = filter(lambda e: type(e) != _intro, parse)
-    intros = list(filter(lambda e: type(e) == _intro, parse))
-    
-    if len(intros) > 0:
-        intro_text = intros[0].text
+def parse_events(lines, comment_start="#"):
+    """Lazily parses lines into a stream of line, intro, start and end events"""
+    return _delimited(_parse_lines(lines, comment_start))
+
+
+def lines_to_tagged_tree(lines, comment_start="#", compact=False, profile=None, regions=None):
+    """Parses lines into a tree of explanations and lines of code, or a CompactDocument"""
+    if profile is None:
+        events = parse_events(lines, comment_start)
     else:
-        intro_text = None
+        events = counted_events(parse_events(lines, comment_start), profile)
     
-    if len(intros) > 1:
-        outro_text = intros[-1].text
-    else:
-        outro_text = None
+    with (profile or _no_profile).timer("parse"):
+        if compact:
+            return CompactDocument.from_events(events)
+        
+        children = []
+        intros = []
+        
+        for e in _to_tree(events, regions):
+            if type(e) == _intro:
+                intros[1:] = [e]
+            else:
+                children.append(e)
+    
+    intro_text = intros[0].text if len(intros) > 0 else None
+    outro_text = intros[1].text if len(intros) > 1 else None
     
     return _root(intro=intro_text, outro=outro_text, children=children)
 
 
+# Stands for a region without an [n] index in the array of region indexes
+_no_index = -1
+
+def _index_or_none(index):
+    return None if index == _no_index else index
+
+
+class CompactDocument(object):
+    """A parsed guide stored in arrays, without an object per line"""
+    
+    _chunk_lines = 4096
+    
+    def __init__(self, intro, outro, text, line_offsets, region_start, region_end, region_depth, region_index, region_text):
+        self.intro = intro
+        self.outro = outro
+        self.text = text
+        self.line_offsets = line_offsets
+        self.region_start = region_start
+        self.region_end = region_end
+        self.region_depth = region_depth
+        self.region_index = region_index
+        self.region_text = region_text
+    
+    @classmethod
+    def from_events(cls, events):
+        chunks = []
+        pending = []
+        line_offsets = array('l', [0])
+        region_start = array('l')
+        region_end = array('l')
+        region_depth = array('l')
+        region_index = array('l')
+        region_text = []
+        intros = []
+        open_regions = []
+        open_starts = []
+        
+        for e in events:
+            t = type(e)
+            if t == line:
+                pending.append(e.text)
+                line_offsets.append(line_offsets[-1] + len(e.text) + 1)
+                if len(pending) >= cls._chunk_lines:
+                    chunks.append("\n".join(pending) + "\n")
+                    del pending[:]
+            elif t == _start:
+                open_regions.append(len(region_text))
+                open_starts.append(e.lineno)
+                region_start.append(len(line_offsets) - 1)
+                region_end.append(-1)
+                region_depth.append(len(open_regions) - 1)
+                region_index.append(_no_index if e.index is None else e.index)
+                region_text.append(e.text)
+            elif t == _end:
+                if not open_regions:
+                    raise MarkupError(e.lineno, "end of region that has not been started")
+                region_end[open_regions.pop()] = len(line_offsets) - 1
+                open_starts.pop()
+            elif t == _intro:
+                if open_regions:
+                    raise MarkupError(e.lineno, "introduction inside a region")
+                intros[1:] = [e]
+            else:
+                raise ValueError("unexpected node: " + repr(e))
+        
+        if open_regions:
+            raise MarkupError(open_starts[-1], "region is not ended")
+        
+        if pending:
+            chunks.append("\n".join(pending) + "\n")
+        
+        return cls(intro=intros[0].text if len(intros) > 0 else None,
+                   outro=intros[1].text if len(intros) > 1 else None,
+                   text="".join(chunks),
+                   line_offsets=line_offsets,
+                   region_start=region_start,
+                   region_end=region_end,
+                   region_depth=region_depth,
+                   region_index=region_index,
+                   region_text=region_text)
+    
+    @property
+    def line_count(self):
+        return len(self.line_offsets) - 1
+    
+    @property
+    def region_count(self):
+        return len(self.region_text)
+    
+    def line_text(self, i):
+        return self.text[self.line_offsets[i]:self.line_offsets[i+1]-1]
+    
+    def events(self):
+        """Yields the lines and the start and end of regions, in document order"""
+        r = 0
+        open_regions = []
+        
+        for i in xrange(self.line_count + 1):
+            while r < self.region_count and self.region_start[r] == i:
+                while len(open_regions) > self.region_depth[r]:
+                    open_regions.pop()
+                    yield _end(lineno=None)
+                open_regions.append(r)
+                yield _start(text=self.region_text[r], index=_index_or_none(self.region_index[r]), lineno=None)
+                r += 1
+            
+            while open_regions and self.region_end[open_regions[-1]] <= i:
+                open_regions.pop()
+                yield _end(lineno=None)
+            
+            if i < self.line_count:
+                yield line(self.line_text(i))
+    
+    def tree(self):
+        return _root(intro=self.intro, outro=self.outro, children=list(_to_tree(self.events())))
+
+
+def first_intro(events):
+    """Returns the text of the first top-level intro, reading no further than that intro"""
+    depth = 0
+    for e in events:
+        t = type(e)
+        if t == _intro and depth == 0:
+            return e.text
+        elif t == _start:
+            depth += 1
+        elif t == _end:
+            if depth == 0:
+                return None
+            depth -= 1
+    return None
+
+
+
+class BufferedXMLGenerator(XMLGenerator):
+    """An XMLGenerator that writes its output in chunks of at least buffer_size characters"""
+    
+    def __init__(self, out=None, encoding="iso-8859-1", buffer_size=64*1024):
+        XMLGenerator.__init__(self, out, encoding)
+        self._out = sys.stdout if out is None else out
+        self._out_is_text = isinstance(self._out, io.TextIOBase)
+        self._buffer = []
+        self._buffered = 0
+        self._buffer_size = buffer_size
+        self._write = self._buffered_write
+        self._flush = self.flush
+    
+    def _buffered_write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self._buffer_size:
+            self._write_buffer()
+    
+    def _write_buffer(self):
+        if self._buffer:
+            text = u"".join(self._buffer)
+            del self._buffer[:]
+            self._buffered = 0
+            self._out.write(text if self._out_is_text else text.encode(self._encoding, "xmlcharrefreplace"))
+    
+    def flush(self):
+        self._write_buffer()
+        flush = getattr(self._out, "flush", None)
+        if flush is not None:
+            flush()
+
+
+def flush_output(out):
+    flush = getattr(out, "flush", None)
+    if flush is not None:
+        flush()
+
 
 class ElementOnlyFilter(XMLFilterBase):
     def startDocument(self):
@@ -128,36 +460,329 @@ def stream_element(out, e):
     out.startElement(e.tag, e.attrib)
     if e.text is not None:
         out.characters(e.text)
-    for c in e:
-        stream_element(out, c)
-    out.endElement(e.tag)
-    if e.tail is not None:
-        out.characters(e.tail)
-
-
-
-def _code_tree_to_html(out, e, code_lexer, md):
-    t = type(e)
-    if t == line:
-        stream_html(out, pygments.highlight(" " if e.text == "" else e.text, code_lexer, HtmlFormatter(cssclass="", classprefix="code-guide-syntax-")))
-    elif t == _explanation:
-        attrs = {
-            "class": "bootstro", 
-            "data-bootstro-content": md.convert(e.text),
-            "data-bootstro-html": "true",
-            "data-bootstro-placement": "right",
-            "data-bootstro-width": "25%"}
-            
-        if e.index is not None:
-            attrs["data-bootstro-step"] = str(e.index - 1)
-                
-        out.startElement("div", attrs)
-                    
-        for c in e.children:
-            _code_tree_to_html(out, c, code_lexer, md)
-        out.endElement("div")
+    
+    open_elements = [(e, iter(e))]
+    while open_elements:
+        parent, children = open_elements[-1]
+        c = next(children, None)
+        if c is None:
+            open_elements.pop()
+            out.endElement(parent.tag)
+            if parent.tail is not None:
+                out.characters(parent.tail)
+        else:
+            out.startElement(c.tag, c.attrib)
+            if c.text is not None:
+                out.characters(c.text)
+            open_elements.append((c, iter(c)))
+
+
+
+def _document_events(root):
+    if isinstance(root, CompactDocument):
+        return root.events()
     else:
-        raise ValueError("unexpected node: " + repr(e))
+        return tree_events(root.children)
+
+def tree_events(children):
+    """Yields the lines and the start and end of each region of a tree, depth first"""
+    open_regions = [iter(children)]
+    
+    while open_regions:
+        for e in open_regions[-1]:
+            if type(e) == _explanation:
+                yield _start(text=e.text, index=e.index, lineno=None)
+                open_regions.append(iter(e.children))
+                break
+            else:
+                yield e
+        else:
+            open_regions.pop()
+            if open_regions:
+                yield _end(lineno=None)
+
+
+def _code_text(text):
+    text = text.replace("\r", "")
+    return text or " "
+
+
+def _split_token_lines(tokens):
+    current = []
+    for ttype, value in tokens:
+        parts = value.split("\n")
+        for part in parts[:-1]:
+            if part:
+                current.append((ttype, part))
+            yield current
+            current = []
+        if parts[-1]:
+            current.append((ttype, parts[-1]))
+    if current:
+        yield current
+
+def _highlight_whole_file(texts, code_lexer):
+    """Lexes the code lines as a single source and yields the tokens of each line"""
+    texts = list(texts)
+    token_lines = _split_token_lines(code_lexer.get_tokens("\n".join(texts)))
+    for text in texts:
+        yield next(token_lines, [])
+
+def _highlight_each_line(texts, code_lexer):
+    for text in texts:
+        yield next(_split_token_lines(code_lexer.get_tokens(text)), [])
+
+
+_syntax_class_prefix = "code-guide-syntax-"
+_syntax_classes = {}
+
+def _syntax_class(ttype):
+    """The CSS class that Pygments' HtmlFormatter gives to tokens of type ttype"""
+    try:
+        return _syntax_classes[ttype]
+    except KeyError:
+        from pygments.token import STANDARD_TYPES
+        
+        fname = STANDARD_TYPES.get(ttype)
+        t = ttype
+        aname = ''
+        while fname is None:
+            aname = '-' + t[-1] + aname
+            t = t.parent
+            fname = STANDARD_TYPES.get(t)
+        cls = _syntax_class_prefix + fname + aname if fname + aname else ""
+        _syntax_classes[ttype] = cls
+        return cls
+
+_syntax_styles = None
+
+def _syntax_style(cls):
+    """The declarations of the rule for syntax class cls in pygments.css, or None"""
+    global _syntax_styles
+    if _syntax_styles is None:
+        _syntax_styles = dict((_syntax_class_prefix + name, " ".join(declarations.split()))
+                              for name, declarations in re.findall(r"\.code-guide-syntax-([\w-]+)\s*\{([^}]*)\}",
+                                                                   resource_data("pygments.css")))
+    return _syntax_styles.get(cls)
+
+
+class CompactSyntaxClasses(object):
+    """Assigns a short CSS class to each distinct style of the token types highlighted in a guide"""
+    
+    def __init__(self, prefix="t"):
+        self.prefix = prefix
+        self._classes = {}
+        self._styles = {}
+        self._rules = []
+    
+    def __call__(self, ttype):
+        try:
+            return self._classes[ttype]
+        except KeyError:
+            style = _syntax_style(_syntax_class(ttype))
+            if style is None:
+                cls = ""
+            elif style in self._styles:
+                cls = self._styles[style]
+            else:
+                cls = self._styles[style] = self.prefix + str(len(self._rules))
+                self._rules.append(".code-guide-code .%s{%s}" % (cls, style))
+            self._classes[ttype] = cls
+            return cls
+    
+    def stylesheet(self):
+        return "".join(self._rules)
+
+
+def _stream_highlighted_line(out, tokens, syntax_class=_syntax_class):
+    """Emits the SAX events of the HTML that Pygments would generate for a line of code"""
+    out.startElement("div", {})
+    out.startElement("pre", {})
+    for cls, group in groupby(tokens, lambda t: syntax_class(t[0])):
+        text = "".join(value for ttype, value in group)
+        if cls:
+            element(out, "span", {"class": cls}, text=text)
+        else:
+            out.characters(text)
+    out.characters(u"\n")
+    out.endElement("pre")
+    out.endElement("div")
+
+
+def _explanation_attrs(e, explain, steps=None):
+    """The attributes of the element of a region, adding its explanation to steps if given"""
+    if steps is not None:
+        attrs = {"class": "bootstro", "id": _step_id(len(steps))}
+        steps.append((e.index, explain(e.text)))
+        return attrs
+    
+    attrs = {
+        "class": "bootstro", 
+        "data-bootstro-content": explain(e.text),
+        "data-bootstro-html": "true",
+        "data-bootstro-placement": "right",
+        "data-bootstro-width": "25%"}
+    
+    if e.index is not None:
+        attrs["data-bootstro-step"] = str(e.index - 1)
+    
+    return attrs
+
+
+def _step_id(n):
+    return "code-guide-step-%d" % n
+
+def _step_order(indexes):
+    """The order in which bootstro shows regions, given the index of each region or None"""
+    by_step = {}
+    for n, index in enumerate(indexes):
+        if index is not None:
+            by_step.setdefault(index - 1, n)
+    return [by_step.get(i, i) for i in range(len(indexes))]
+
+def _write_step_table(out, steps):
+    """Writes the explanations in the order they are shown, as a JSON table for code-guide.js"""
+    order = _step_order([index for index, content in steps])
+    table = json.dumps([{"id": _step_id(n), "content": steps[n][1]} for n in order], separators=(",", ":"))
+    
+    out.startElement("script", {"type": "application/json", "id": "code-guide-steps"})
+    if isinstance(out, XMLGenerator):
+        out.ignorableWhitespace(u"<![CDATA[" + table.replace("</", "<\\/").replace("]]>", "]]\\u003e") + u"]]>")
+    else:
+        out.characters(table)
+    out.endElement("script")
+
+
+def _code_events_to_html(out, events, code_lexer, explain, highlight, chunk_size=None, syntax_class=_syntax_class,
+                         steps=None):
+    """Writes the lines and regions in a stream of events as HTML, highlighted in chunks"""
+    chunk = []
+    
+    def write_chunk():
+        highlighted_lines = highlight([_code_text(e.text) for e in chunk if type(e) == line], code_lexer)
+        for e in chunk:
+            t = type(e)
+            if t == line:
+                _stream_highlighted_line(out, next(highlighted_lines), syntax_class)
+            elif t == _start:
+                out.startElement("div", _explanation_attrs(e, explain, steps))
+            elif t == _end:
+                out.endElement("div")
+            else:
+                raise ValueError("unexpected node: " + repr(e))
+        del chunk[:]
+    
+    for e in events:
+        chunk.append(e)
+        if chunk_size is not None and len(chunk) >= chunk_size:
+            write_chunk()
+    
+    write_chunk()
+
+
+def _fragments(events):
+    """Groups events into fragments: each top-level region and each run of lines between them"""
+    fragment = []
+    depth = 0
+    for e in events:
+        t = type(e)
+        if t == _start:
+            if depth == 0 and fragment:
+                yield fragment
+                fragment = []
+            depth += 1
+        elif t == _end:
+            depth -= 1
+        
+        fragment.append(e)
+        
+        if t == _end and depth == 0:
+            yield fragment
+            fragment = []
+    
+    if fragment:
+        yield fragment
+
+
+def _utf8(s):
+    return s.encode("utf-8") if isinstance(s, unicode) else s
+
+def _fragment_key(settings, fragment):
+    """The cache key of a fragment, which does not depend on its line numbers"""
+    h = hashlib.sha1(settings)
+    for e in fragment:
+        t = type(e)
+        if t == line:
+            h.update("\0l" + _utf8(e.text))
+        elif t == _start:
+            h.update("\0s%s\0" % e.index + _utf8(e.text or ""))
+        else:
+            h.update("\0e")
+    return h.hexdigest()
+
+
+class _ChildrenOnlyFilter(ElementOnlyFilter):
+    """Passes on the events of the children of the root element"""
+    
+    def startDocument(self):
+        self._depth = 0
+    
+    def startElement(self, name, attrs):
+        self._depth += 1
+        if self._depth > 1:
+            ElementOnlyFilter.startElement(self, name, attrs)
+    
+    def endElement(self, name):
+        self._depth -= 1
+        if self._depth > 0:
+            ElementOnlyFilter.endElement(self, name)
+
+def _write_fragment(out, html):
+    """Writes the HTML of a fragment to any content handler"""
+    if isinstance(out, XMLGenerator):
+        out.ignorableWhitespace(html)
+    else:
+        filter = _ChildrenOnlyFilter()
+        filter.setContentHandler(out)
+        xml.sax.parseString((u"<fragment>" + html + u"</fragment>").encode("utf-8"), filter)
+
+
+def _cached_code_events_to_html(out, events, code_lexer, explain, highlight, fragment_cache, settings, 
+                                profile=_no_profile):
+    """As _code_events_to_html, but only renders the fragments that are not in the fragment cache"""
+    for fragment in _fragments(events):
+        key = _fragment_key(settings, fragment)
+        html = fragment_cache.get(key)
+        if html is None:
+            profile.count("fragment cache misses")
+            buf = io.StringIO()
+            fragment_out = BufferedXMLGenerator(buf)
+            _code_events_to_html(fragment_out, fragment, code_lexer, explain, highlight)
+            fragment_out.flush()
+            html = buf.getvalue()
+            fragment_cache.put(key, html)
+        else:
+            profile.count("fragment cache hits")
+        _write_fragment(out, html)
+    
+    fragment_cache.save()
+
+
+def _code_writer(out, events, code_lexer, explain, highlight, compact_highlighting, chunk_size=None,
+                 step_table=False):
+    """Returns a function that writes the code of a page"""
+    def write_code():
+        syntax_class = CompactSyntaxClasses() if compact_highlighting else _syntax_class
+        steps = [] if step_table else None
+        
+        _code_events_to_html(out, events, code_lexer, explain, highlight, chunk_size, syntax_class, steps)
+        
+        if compact_highlighting:
+            element(out, "style", {"type": "text/css"}, text=syntax_class.stylesheet())
+        if step_table:
+            _write_step_table(out, steps)
+    
+    return write_code
 
 
 def element(out, name, attrs, text=None):
@@ -181,9 +806,53 @@ _stylesheets = ["bootstrap/css/bootstrap{min}.css",
 def identity(x):
     return x
 
+
+def write_code(out, children, syntax_highlight="python", link_transform_fn=identity, markdown_cache=None,
+               profile=None):
+    """Writes the lines and explanations of a tree in a code-guide-code div"""
+    if markdown_cache is None:
+        markdown_cache = default_markdown_cache
+    if profile is None:
+        profile = _no_profile
+    
+    md = markdown_converter(link_transform_fn)
+    
+    def explain(text):
+        return markdown_cache.xhtml(md, link_transform_fn, text, profile)
+    
+    with profile.timer("render"), _profiled_writes(out, profile):
+        out.startElement("div", {"class": "code-guide-code"})
+        _code_events_to_html(out, tree_events(children), _lexer(syntax_highlight), explain,
+                             _profiled_highlight(_highlight_whole_file, profile))
+        out.endElement("div")
+        flush_output(out)
+
+
+class RegexSubstitution(object):
+    """A regex substitution that, unlike a lambda, can be pickled and compared"""
+    
+    def __init__(self, regex, subn):
+        self.regex = regex
+        self.subn = subn
+        self.pattern = re.compile(regex)
+    
+    def __call__(self, s):
+        return self.pattern.subn(self.subn, s)[0]
+    
+    def __eq__(self, other):
+        return type(other) == RegexSubstitution and (self.regex, self.subn) == (other.regex, other.subn)
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return hash((self.regex, self.subn))
+    
+    def __repr__(self):
+        return "re_subn(%r, %r)" % (self.regex, self.subn)
+
 def re_subn(regex, subn):
-    p = re.compile(regex)
-    return lambda s: p.subn(subn, s)[0]
+    return RegexSubstitution(regex, subn)
 
 
 
@@ -200,44 +869,298 @@ class LinkTransformer(object):
         return tree
 
 
-def to_html(root, out=None, syntax_highlight="python", resource_dir="", minified=True, link_transform_fn=identity):
-    if out is None:
-        out = XMLGenerator(sys.stdout)
+class MarkdownCache(object):
+    """A thread-safe LRU memo of Markdown converted to XHTML and parsed into elements"""
+    
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _lookup(self, key, convert, profile, miss_counter):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                value = self._entries.pop(key)
+                self._entries[key] = value
+                profile.count("markdown cache hits")
+                return value
+            else:
+                self.misses += 1
+        
+        profile.count(miss_counter)
+        
+        value = convert()
+        
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        
+        return value
+    
+    def xhtml(self, md, link_transform_fn, text, profile=None):
+        if profile is None:
+            profile = _no_profile
+        
+        def convert():
+            with profile.timer("markdown"):
+                return md.convert(text)
+        
+        return self._lookup(("xhtml", link_transform_fn, text), convert, profile, "markdown conversions")
+    
+    def element(self, md, link_transform_fn, text, css_class, profile=None):
+        """Returns the text as a shared div element of the given class, which must not be modified"""
+        if profile is None:
+            profile = _no_profile
+        
+        def convert():
+            xhtml = self.xhtml(md, link_transform_fn, text, profile)
+            with profile.timer("xhtml parsing"):
+                return etree_from_string('<div class="' + css_class + '">' + xhtml + '</div>')
+        
+        return self._lookup(("div", css_class, link_transform_fn, text), convert, profile, "xhtml parses")
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+default_markdown_cache = MarkdownCache()
+
+
+_lexers = {}
+
+def _lexer(syntax_highlight):
+    """Returns the Pygments lexer for a language, which is created once per process"""
+    try:
+        return _lexers[syntax_highlight]
+    except KeyError:
+        import pygments.lexers
+        code_lexer = _lexers[syntax_highlight] = pygments.lexers.get_lexer_by_name(syntax_highlight)
+        return code_lexer
+
+
+_line_comment_languages = [
+    ("#", ["python", "python3", "rb", "bash", "perl", "tcl", "make", "cmake", "yaml", "powershell", "elixir",
+           "julia", "nimrod", "coffee-script", "splus", "awk", "nginx", "apacheconf", "cfengine3", "puppet",
+           "fish", "factor", "io", "gnuplot", "sourceslist"]),
+    ("//", ["java", "c", "cpp", "csharp", "objective-c", "js", "ts", "go", "scala", "groovy", "kotlin", "rust",
+            "fsharp", "d", "dart", "php", "as", "as3", "haxeml", "vala", "ceylon", "fan", "ooc", "glsl", "hlsl",
+            "nemerle", "boo", "dylan", "modula2", "cuda", "opa", "monkey"]),
+    ("--", ["haskell", "sql", "mysql", "postgresql", "plpgsql", "lua", "moon", "ada", "vhdl", "applescript",
+            "eiffel", "agda", "idris", "lhs"]),
+    (";", ["clojure", "scheme", "common-lisp", "newlisp", "racket", "hy", "nasm", "ini", "autoit"]),
+    ("%", ["erlang", "tex", "matlab", "octave", "prolog", "logtalk"]),
+    ("'", ["vb.net"]),
+    ("!", ["fortran"])
+]
+
+_line_comments = dict((language, comment_start)
+                      for comment_start, languages in _line_comment_languages
+                      for language in languages)
+
+def _comment_start(syntax_highlight):
+    """The syntax that starts a line comment in a language, # if unknown"""
+    try:
+        return _line_comments[syntax_highlight]
+    except KeyError:
+        comment_start = _line_comments.get(_lexer(syntax_highlight).aliases[0], "#")
+        _line_comments[syntax_highlight] = comment_start
+        return comment_start
+
+
+_filename_index = None
+_languages_by_extension = {}
+
+def _lexer_filename_index():
+    """Indexes the file name patterns of Pygments' lexers without loading the lexers"""
+    global _filename_index
+    if _filename_index is None:
+        from pygments.lexers._mapping import LEXERS
+        
+        by_extension = {}
+        patterns = []
+        for module, name, aliases, filenames, mimetypes in LEXERS.values():
+            if not aliases:
+                continue
+            for f in filenames:
+                ext = f[1:]
+                if f.startswith("*.") and ext.count(".") == 1 and not any(c in ext for c in "*?["):
+                    by_extension.setdefault(ext, []).append(aliases[0])
+                else:
+                    patterns.append((f, aliases[0]))
+        
+        _filename_index = by_extension, patterns
     
-    code_lexer = pygments.lexers.get_lexer_by_name(syntax_highlight)
+    return _filename_index
+
+def _language_for_filename(filename):
+    by_extension, patterns = _lexer_filename_index()
+    
+    for pattern, language in patterns:
+        if fnmatch(filename, pattern):
+            return language
     
-    md = markdown.Markdown(safe_mode="escape", output_format="xhtml5")
-    md.treeprocessors["codelinks"] = LinkTransformer(link_transform_fn)
+    ext = os.path.splitext(filename)[1]
+    languages = by_extension.get(ext, [])
+    if len(languages) == 1:
+        return languages[0]
+    elif len(languages) > 1:
+        try:
+            return _languages_by_extension[ext]
+        except KeyError:
+            import pygments.lexers
+            language = _languages_by_extension[ext] = \
+                pygments.lexers.get_lexer_for_filename("file" + ext).aliases[0]
+            return language
+    else:
+        return None
+
+
+def detect_language(filename, syntax_highlight=None, comment_start=None):
+    """Returns the (syntax_highlight, comment_start) of a file, detecting those not given"""
+    if syntax_highlight is None:
+        syntax_highlight = (filename is not None and _language_for_filename(os.path.basename(filename))) or "python"
+    if comment_start is None:
+        comment_start = _comment_start(syntax_highlight)
     
+    return syntax_highlight, comment_start
+
+
+_thread_state = threading.local()
+_markdown_per_thread = 8
+
+def markdown_converter(link_transform_fn):
+    """Returns a reset Markdown converter for link_transform_fn, reused by each thread"""
+    converters = getattr(_thread_state, "markdown", None)
+    if converters is None:
+        converters = _thread_state.markdown = OrderedDict()
+    
+    try:
+        md = converters.pop(link_transform_fn)
+    except KeyError:
+        import markdown
+        md = markdown.Markdown(safe_mode="escape", output_format="xhtml5")
+        md.treeprocessors["codelinks"] = LinkTransformer(link_transform_fn)
+    else:
+        md.reset()
+    
+    converters[link_transform_fn] = md
+    while len(converters) > _markdown_per_thread:
+        converters.popitem(last=False)
+    
+    return md
+
+
+class _ProfiledFile(object):
+    """Adds the time taken to write to and flush a file, and the bytes written, to a profile"""
+    
+    def __init__(self, f, profile):
+        self.f = f
+        self.profile = profile
+    
+    def write(self, data):
+        with self.profile.timer("write"):
+            self.f.write(data)
+        self.profile.count("bytes written", len(data))
+    
+    def flush(self):
+        flush = getattr(self.f, "flush", None)
+        if flush is not None:
+            with self.profile.timer("write"):
+                flush()
+
+
+@contextmanager
+def _profiled_writes(out, profile):
+    """Adds the time an XMLGenerator takes to write its output, and the bytes written, to the profile"""
+    if profile is not _no_profile and isinstance(out, BufferedXMLGenerator):
+        f = out._out
+        out._out = _ProfiledFile(f, profile)
+        try:
+            yield
+        finally:
+            out._out = f
+        return
+    
+    write = getattr(out, "_write", None)
+    if profile is _no_profile or write is None:
+        yield
+        return
+    
+    encoding = getattr(out, "_encoding", "iso-8859-1")
+    
+    def profiled_write(s):
+        start = time.time()
+        write(s)
+        profile.add_time("write", time.time() - start)
+        profile.count("bytes written", len(s.encode(encoding, "xmlcharrefreplace") if isinstance(s, unicode) else s))
+    
+    out._write = profiled_write
+    try:
+        yield
+    finally:
+        out._write = write
+
+
+resource_modes = ["link", "inline", "bundle"]
+
+def write_resource_links(out, resource_dir, minified, resources="link"):
+    """Writes the stylesheets and scripts of a page, as links, bundle links or inline"""
     resource_prefix = resource_dir if resource_dir == "" or resource_dir.endswith("/") else resource_dir + "/"
     min_suffix = ".min" if minified else ""
     
     def resource(r):
         return resource_prefix + r.format(min=min_suffix)
     
-    def stylesheet(relpath):
-        element(out, "link", {"rel": "stylesheet", "type": "text/css", "href": resource(relpath)})
-    
-    def script(relpath):
-        element(out, "script", {"type": "text/javascript", "src": resource(relpath)})
-    
-    if root.intro:
-        intro_etree = etree_from_string('<div class="code-guide-intro">' + md.convert(root.intro) + '</div>')
-        h1 = intro_etree.find("h1")
-        title = None if h1 is None else "".join(h1.itertext())
+    if resources == "link":
+        for s in _stylesheets:
+            element(out, "link", {"rel": "stylesheet", "type": "text/css", "href": resource(s)})
+        for s in _scripts:
+            element(out, "script", {"type": "text/javascript", "src": resource(s)})
+    elif resources == "bundle":
+        from code_guide import bundle
+        element(out, "link", {"rel": "stylesheet", "type": "text/css", "href": resource_prefix + bundle.bundle_name("css")})
+        element(out, "script", {"type": "text/javascript", "src": resource_prefix + bundle.bundle_name("js")})
+    elif resources == "inline":
+        from code_guide import bundle
+        for tag, attrs, text in [("style", {"type": "text/css"}, bundle.css()),
+                                 ("script", {"type": "text/javascript"}, bundle.js())]:
+            out.startElement(tag, attrs)
+            # The CDATA section, hidden from HTML parsers in a comment, keeps the page well-formed XML
+            out.ignorableWhitespace(u"/*<![CDATA[*/" + text.decode("ascii") + u"/*]]>*/")
+            out.endElement(tag)
     else:
-        intro_etree = None
-        title = None
+        raise ValueError("unknown resources mode: " + repr(resources))
+
+
+def title_of(intro_etree):
+    """The title of a guide: the text of the top-level heading of its intro"""
+    h1 = None if intro_etree is None else intro_etree.find("h1")
+    return None if h1 is None else "".join(h1.itertext())
+
+
+_colophon = """
+       <div class="colophon">
+         <p>Generated with <a href="http://github.com/npryce/code-guide">Code Guide</a>.</p>
+       </div>
+       """
+
+def _write_page(out, intro_etree, write_code, outro_etree, resource_dir, minified, profile=_no_profile,
+                resources="link"):
+    """Writes an HTML page around the code written by write_code()"""
+    title = title_of(intro_etree)
     
     out.startElement("html", {})
     
     out.startElement("head", {})
     if title is not None:
         element(out, "title", {}, text=title)
-    for s in _stylesheets:
-        stylesheet(s)
-    for s in _scripts:
-        script(s)
+    write_resource_links(out, resource_dir, minified, resources)
     out.endElement("head")
     
     out.startElement("body", {})
@@ -254,76 +1177,481 @@ def to_html(root, out=None, syntax_highlight="python", resource_dir="", minified
     out.endElement("p")
     
     out.startElement("div", {"class": "code-guide-code"})
-    for e in root.children:
-        _code_tree_to_html(out, e, code_lexer, md)
+    write_code()
     out.endElement("div")
     
-    if root.outro:
-        stream_element(out, etree_from_string('<div class="code-guide-outro">' + md.convert(root.outro) + '</div>'))
+    outro = outro_etree()
+    if outro is not None:
+        stream_element(out, outro)
     
-    stream_html(out, """
-       <div class="colophon">
-         <p>Generated with <a href="http://github.com/npryce/code-guide">Code Guide</a>.</p>
-       </div>
-       """);
+    with profile.timer("xhtml parsing"):
+        stream_html(out, _colophon)
     
     out.endElement("body")
     out.endElement("html")
 
 
+def _profiled_highlight(highlight, profile):
+    if profile is _no_profile:
+        return highlight
+    else:
+        return lambda texts, code_lexer: profile.timed("highlight", highlight(texts, code_lexer))
+
+
+def to_html(root, out=None, syntax_highlight="python", resource_dir="", minified=True, link_transform_fn=identity,
+            whole_file_highlighting=True, markdown_cache=None, profile=None, resources="link",
+            compact_highlighting=False, fragment_cache=None, step_table=False):
+    """Renders a tree parsed by lines_to_tagged_tree as HTML"""
+    if out is None:
+        out = BufferedXMLGenerator(sys.stdout)
+    
+    if markdown_cache is None:
+        markdown_cache = default_markdown_cache
+    
+    if profile is None:
+        profile = _no_profile
+    
+    code_lexer = _lexer(syntax_highlight)
+    md = markdown_converter(link_transform_fn)
+    highlight = _profiled_highlight(_highlight_whole_file if whole_file_highlighting else _highlight_each_line, profile)
+    
+    def explain(text):
+        return markdown_cache.xhtml(md, link_transform_fn, text, profile)
+    
+    def div(text, css_class):
+        return None if not text else markdown_cache.element(md, link_transform_fn, text, css_class, profile)
+    
+    if fragment_cache is None:
+        # A CompactDocument is highlighted in chunks, so that its lines are never all held as objects at once
+        chunk_size = root._chunk_lines if isinstance(root, CompactDocument) else None
+        write_code = _code_writer(out, _document_events(root), code_lexer, explain, highlight, compact_highlighting,
+                                  chunk_size, step_table)
+    elif compact_highlighting or step_table:
+        raise ValueError("cannot cache the fragments of guides with compact highlighting or a step table")
+    else:
+        from code_guide.cache import fragment_settings_key
+        settings = fragment_settings_key(syntax_highlight, link_transform_fn, whole_file_highlighting)
+        write_code = lambda: _cached_code_events_to_html(out, _document_events(root), code_lexer, explain, highlight,
+                                                         fragment_cache, settings, profile)
+    
+    with profile.timer("render"), _profiled_writes(out, profile):
+        _write_page(out, div(root.intro, "code-guide-intro"),
+                    write_code,
+                    lambda: div(root.outro, "code-guide-outro"),
+                    resource_dir, minified, profile, resources)
+        flush_output(out)
+
+
+def stream_to_html(events, out=None, intro=None, syntax_highlight="python", resource_dir="", minified=True, 
+                   link_transform_fn=identity, whole_file_highlighting=True, markdown_cache=None, chunk_size=1000,
+                   profile=None, resources="link", compact_highlighting=False, step_table=False):
+    """Renders a stream of parse events as HTML in constant memory, given the intro"""
+    if out is None:
+        out = BufferedXMLGenerator(sys.stdout)
+    
+    if markdown_cache is None:
+        markdown_cache = default_markdown_cache
+    
+    if profile is None:
+        profile = _no_profile
+    else:
+        events = counted_events(events, profile)
+    
+    code_lexer = _lexer(syntax_highlight)
+    md = markdown_converter(link_transform_fn)
+    highlight = _profiled_highlight(_highlight_whole_file if whole_file_highlighting else _highlight_each_line, profile)
+    intros = []
+    
+    def explain(text):
+        return markdown_cache.xhtml(md, link_transform_fn, text, profile)
+    
+    def div(text, css_class):
+        return None if not text else markdown_cache.element(md, link_transform_fn, text, css_class, profile)
+    
+    def code_events():
+        open_starts = []
+        for e in events:
+            t = type(e)
+            if t == _intro:
+                if open_starts:
+                    raise MarkupError(e.lineno, "introduction inside a region")
+                intros[1:] = [e]
+                continue
+            elif t == _start:
+                open_starts.append(e.lineno)
+            elif t == _end:
+                if not open_starts:
+                    raise MarkupError(e.lineno, "end of region that has not been started")
+                open_starts.pop()
+            yield e
+        
+        if open_starts:
+            raise MarkupError(open_starts[-1], "region is not ended")
+    
+    with profile.timer("render"), _profiled_writes(out, profile):
+        _write_page(out, div(intro, "code-guide-intro"),
+                    _code_writer(out, code_events(), code_lexer, explain, highlight, compact_highlighting, chunk_size,
+                                 step_table),
+                    lambda: div(intros[1].text, "code-guide-outro") if len(intros) > 1 else None,
+                    resource_dir, minified, profile, resources)
+        flush_output(out)
+
+
+def stream_file_to_html(input, out=None, comment_start="#", **kwargs):
+    """Renders a seekable file as HTML in constant memory by reading it twice"""
+    start = input.tell()
+    intro = first_intro(parse_events(iter_lines(input), comment_start))
+    input.seek(start)
+    stream_to_html(parse_events(iter_lines(input), comment_start), out, intro=intro, **kwargs)
+
+
+class Renderer(object):
+    """Renders guides with options set once, and can be shared between threads"""
+    
+    def __init__(self, syntax_highlight="python", comment_start="#", resource_dir="", minified=True, 
+                 link_transform_fn=identity, resources="link", compact_highlighting=False,
+                 whole_file_highlighting=True, markdown_cache=None, fragment_cache=None, step_table=False):
+        if resources not in resource_modes:
+            raise ValueError("unknown resources mode: " + repr(resources))
+        
+        self.syntax_highlight = syntax_highlight
+        self.comment_start = comment_start
+        self.resource_dir = resource_dir
+        self.minified = minified
+        self.link_transform_fn = link_transform_fn
+        self.resources = resources
+        self.compact_highlighting = compact_highlighting
+        self.whole_file_highlighting = whole_file_highlighting
+        self.markdown_cache = default_markdown_cache if markdown_cache is None else markdown_cache
+        self.fragment_cache = fragment_cache
+        self.step_table = step_table
+        
+        _lexer(syntax_highlight)
+    
+    def render_to(self, lines, out, profile=None):
+        """Writes the guide marked up in the source lines as HTML to the binary file out"""
+        to_html(lines_to_tagged_tree(lines, self.comment_start, profile=profile),
+                out=BufferedXMLGenerator(out),
+                syntax_highlight=self.syntax_highlight,
+                resource_dir=self.resource_dir,
+                minified=self.minified,
+                link_transform_fn=self.link_transform_fn,
+                whole_file_highlighting=self.whole_file_highlighting,
+                markdown_cache=self.markdown_cache,
+                profile=profile,
+                resources=self.resources,
+                compact_highlighting=self.compact_highlighting,
+                fragment_cache=self.fragment_cache,
+                step_table=self.step_table)
+    
+    def render(self, lines, profile=None):
+        """Returns the guide marked up in the source lines as HTML"""
+        out = io.BytesIO()
+        self.render_to(lines, out, profile)
+        return out.getvalue()
+
+
 def is_html_resource(r):
     return not (r.endswith(".py") or r.endswith(".pyc"))
 
 
+def _package_relative(r):
+    """Resource name r without its leading ".", which zipped packages do not accept"""
+    return "" if r == "." else r[2:] if r.startswith("./") else r
+
+def resource_data(r):
+    """The content of resource r, read with pkgutil, which is quicker to import than pkg_resources"""
+    return pkgutil.get_data(__name__, _package_relative(r))
+
+
 def resource_names(d="."):
-    for n in resource_listdir(__name__, d):
+    """The resources beneath d, listed with pkg_resources so that they can be listed in a zipped package"""
+    from pkg_resources import resource_listdir, resource_isdir
+    
+    for n in sorted(filter(None, resource_listdir(__name__, _package_relative(d)))):
         r = d + "/" + n
         
-        if resource_isdir(__name__, r):
+        if resource_isdir(__name__, _package_relative(r)):
             for n2 in resource_names(r):
                 yield n2
         elif is_html_resource(r):
             yield r
 
+def ensure_dir(d):
+    """Creates directory d and its parents if they do not exist"""
+    if d and not os.path.isdir(d):
+        try:
+            os.makedirs(d)
+        except OSError:
+            if not os.path.isdir(d):
+                raise
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+# The mode that open() would give a new file.  The umask can only be read by 
+# setting it, which would affect files that other threads create at the same 
+# time, so it is read once, when the module is imported.
+_new_file_mode = 0666 & ~_umask()
+
+@contextmanager
+def atomic_output(path):
+    """Opens a temporary file that is renamed over path when the with block ends"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            yield f
+        os.chmod(tmp, _new_file_mode)
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+    except:
+        os.remove(tmp)
+        raise
+
+
+@contextmanager
+def output_file(path):
+    """Opens path for writing with atomic_output, or yields stdout if path is None or "-" """
+    if use_stdio(path):
+        yield sys.stdout
+        sys.stdout.flush()
+    else:
+        with atomic_output(path) as f:
+            yield f
+
+
+def write_atomically(path, data):
+    """Writes data to path atomically"""
+    with atomic_output(path) as f:
+        f.write(data)
+
+
+def write_if_changed(path, data):
+    """Writes data to path unless it already has that content, returning True if written"""
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return False
+    except (OSError, IOError):
+        pass
+    
+    write_atomically(path, data)
+    return True
+
+
 def extract_resource(r, basedir):
     outf = os.path.join(basedir,r)
-    outdir = os.path.dirname(outf)
-    
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
+    ensure_dir(os.path.dirname(outf))
+    write_atomically(outf, resource_data(r))
+
+
+def referenced_resources(minified=True):
+    """The resources used by the HTML that to_html generates"""
+    min_suffix = ".min" if minified else ""
     
-    with resource_stream(__name__, r) as input, open(outf, "w") as output:
-        copyfileobj(input, output)
+    return ["./" + r.format(min=min_suffix) for r in _stylesheets + _scripts] + \
+        [r for r in resource_names() if r.endswith(".png")]
+
+
+_resource_manifest = ".code-guide-resources.json"
+
+def _read_manifest(path):
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+        return manifest if isinstance(manifest, dict) else {}
+    except (IOError, ValueError):
+        return {}
 
 
 
 def lines(input):
     return [l.rstrip('\n') for l in input]
 
+def iter_lines(input):
+    for l in input:
+        yield l.rstrip('\n')
+
 
 def _only_extract_resources(args):
-    return args.source is None and args.output is None and args.extract_resources
+    return len(args.sources) == 0 and args.output is None and args.extract_resources
+
+def resource_dir_for(output, resource_dir):
+    return urllib.url2pathname(urllib.basejoin("." if output is None else output, resource_dir))
 
-def extract_resources(output, resource_dir):
-    dst_dir = urllib.url2pathname(urllib.basejoin("." if output is None else output, resource_dir))
-    extract_resources_to(dst_dir)
+def extract_resources(output, resource_dir, minified=None):
+    extract_resources_to(resource_dir_for(output, resource_dir), minified)
     
-def extract_resources_to(d):
-    for r in resource_names():
-        extract_resource(r, d)
+def extract_resources_to(d, minified=None):
+    """Extracts the resources, or those used with minified if not None, that have changed to d"""
+    manifest_path = os.path.join(d, _resource_manifest)
+    manifest = _read_manifest(manifest_path)
+    updated = False
+    
+    for r in (resource_names() if minified is None else referenced_resources(minified)):
+        data = resource_data(r)
+        entry = {"size": len(data), "sha1": hashlib.sha1(data).hexdigest()}
+        outf = os.path.join(d, r)
+        
+        if manifest.get(r) == entry and os.path.isfile(outf) and os.path.getsize(outf) == len(data):
+            continue
+        
+        ensure_dir(os.path.dirname(outf))
+        write_atomically(outf, data)
+        manifest[r] = entry
+        updated = True
+    
+    if updated:
+        write_atomically(manifest_path, json.dumps(manifest, indent=1, sort_keys=True))
 
 def use_stdio(fname):
     return fname is None or fname == "-"
 
+
+_conversion_options = namedtuple('_conversion_options', 
+    ['comment_start', 'syntax_highlight', 'resource_dir', 'link_transform_fn', 'resources', 'compact_highlighting',
+     'cache_fragments', 'step_table'])
+_conversion_options.__new__.__defaults__ = ("link", False, False, False)
+
+def convert_file(source, output, options, cache=None, profile=None):
+    """Converts the source file to an HTML guide in the output file"""
+    from code_guide.cache import render_key, process_fragment_cache
+    
+    syntax_highlight, comment_start = detect_language(source, options.syntax_highlight, options.comment_start)
+    options = options._replace(syntax_highlight=syntax_highlight, comment_start=comment_start)
+    
+    ensure_dir(os.path.dirname(output))
+    
+    with open(source, "rb") as input:
+        text = input.read()
+    
+    key = None if cache is None else render_key(text, options)
+    html = None if cache is None else cache.get(key)
+    
+    if profile is not None:
+        profile.count("files")
+        if cache is not None:
+            profile.count("cache hits" if html is not None else "cache misses")
+    
+    if html is None:
+        try:
+            tree = lines_to_tagged_tree(lines(io.BytesIO(text)), options.comment_start, profile=profile)
+        except MarkupError as e:
+            raise MarkupError(e.lineno, e.description, source)
+        
+        buf = io.BytesIO()
+        to_html(tree,
+                out=BufferedXMLGenerator(buf),
+                syntax_highlight=options.syntax_highlight,
+                resource_dir=options.resource_dir,
+                link_transform_fn=options.link_transform_fn,
+                profile=profile,
+                resources=options.resources,
+                compact_highlighting=options.compact_highlighting,
+                fragment_cache=process_fragment_cache(cache) if options.cache_fragments else None,
+                step_table=options.step_table)
+        html = buf.getvalue()
+        
+        if cache is not None:
+            cache.put(key, html)
+    
+    with (profile or _no_profile).timer("output"):
+        write_if_changed(output, html)
+    
+    return output
+
+def _convert_job(job):
+    source, output, options, cache, profiled = job
+    profile = Profile() if profiled else None
+    return convert_file(source, output, options, cache, profile), profile
+
+
+def batch_sources(sources, output_transform_fn):
+    """Pairs each source file, and each file beneath source directories, with its output"""
+    for source in sources:
+        if os.path.isdir(source):
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                for f in sorted(filenames):
+                    path = os.path.join(dirpath, f)
+                    if output_transform_fn.pattern.search(path):
+                        yield path, output_transform_fn(path)
+        else:
+            yield source, output_transform_fn(source)
+
+
+def changed_files(paths, interval=0.5, sleep=time.sleep):
+    """Yields each of the files named by paths() that changes, polling every interval seconds"""
+    stamps = None
+    
+    while True:
+        previous = stamps
+        stamps = {}
+        for path in paths():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamps[path] = (st.st_mtime, st.st_size)
+            if previous is not None and previous.get(path) != stamps[path]:
+                yield path
+        
+        sleep(interval)
+
+
+def convert_files(conversions, options, jobs=None, cache=None, profile=None):
+    """Converts (source, output) pairs on a pool of processes, yielding each output"""
+    import multiprocessing
+    
+    conversions = list(conversions)
+    
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(conversions))
+    
+    work = [(source, output, options, cache, profile is not None) for source, output in conversions]
+    
+    if jobs <= 1:
+        for output, job_profile in map(_convert_job, work):
+            if profile is not None:
+                profile.add(job_profile)
+            yield output
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            for output, job_profile in pool.imap_unordered(_convert_job, work):
+                if profile is not None:
+                    profile.add(job_profile)
+                yield output
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
 def cli(argv):
+    if len(argv) > 1 and argv[1] == "serve":
+        from code_guide.server import serve_cli
+        return serve_cli(argv)
+    
+    import argparse
+    
     parser = argparse.ArgumentParser(description="Generate interactive HTML documentation from example code",
                                      epilog="If --extract-resources is given but source and output are not, %(prog)s "
-                                            "only writes out the resources and does not convert stdin to stdout")
+                                            "only writes out the resources and does not convert stdin to stdout.  "
+                                            "Run '%(prog)s serve --help' for help on serving guides over HTTP.")
 
-    parser.add_argument('-l', '--highlight', dest='syntax_highlight', default='python', metavar='LANGUAGE',
-                        help='apply syntax highlighting for language LANGUAGE (default: %(default)s)')
-    parser.add_argument('-c', '--comment-start', dest='comment_start', default='#',
-                        help='the syntax used to start single-line comments (default: %(default)s)')
+    parser.add_argument('-l', '--highlight', dest='syntax_highlight', default=None, metavar='LANGUAGE',
+                        help='apply syntax highlighting for language LANGUAGE (default: detected from the name of '
+                             'each source file, or python)')
+    parser.add_argument('-c', '--comment-start', dest='comment_start', default=None,
+                        help='the syntax used to start single-line comments (default: detected from the language)')
     parser.add_argument('-o', '--output', dest='output', default=None,
                         help='output file (default: write to stdout)')
     parser.add_argument('-t', '--link-transform', dest='link_transform_fn', nargs=2, metavar=('REGEX','SUBSTITUTION'),
@@ -333,17 +1661,304 @@ def cli(argv):
                         help='prepend directory DIR to the relative URLs of scripts and stylesheets')
     parser.add_argument('-x', '--extract-resources', dest='extract_resources', default=False, action='store_true',
                         help="extract resources to RESOURCE_DIR (default=no)")
-    parser.add_argument('source', nargs='?', default=None, metavar='file',
+    parser.add_argument('-u', '--only-used-resources', dest='only_used_resources', default=False, action='store_true',
+                        help="extract only the resources that the generated HTML uses (default: extract all resources)")
+    parser.add_argument('--resources', dest='resources', choices=resource_modes, default='link',
+                        help='link to each stylesheet and script in RESOURCE_DIR (link), link to a single '
+                             'bundled stylesheet and script whose names contain a hash of their content, so they '
+                             'can be cached forever (bundle), or write the bundles into every page, so each page '
+                             'needs no other files (inline).  The bundles leave out the parts of Bootstrap that '
+                             'guides do not use (default: %(default)s)')
+    parser.add_argument('--compact-highlighting', dest='compact_highlighting', default=False, action='store_true',
+                        help='highlight code with short CSS classes, one for each distinct style, and write a '
+                             'stylesheet of only the styles that the guide uses into the page.  Makes the HTML of '
+                             'large guides much smaller (default: use the classes styled by pygments.css)')
+    parser.add_argument('--cache-fragments', dest='cache_fragments', default=False, action='store_true',
+                        help='also cache the HTML of each top-level region of a guide, so that when a guide is '
+                             'edited only the regions that have changed are rendered again.  Each region is '
+                             'highlighted separately.  Cannot be used with --compact-highlighting or --step-table')
+    parser.add_argument('--step-table', dest='step_table', default=False, action='store_true',
+                        help='write the explanations in a single table of steps after the code, rather than in '
+                             'attributes of every region, so that large guides are smaller and quicker to start '
+                             'explaining.  Cannot be used with --cache-fragments')
+    parser.add_argument('--region', dest='region', type=int, default=None, metavar='N',
+                        help='write only the HTML of the region marked with index [N], within the regions that '
+                             'enclose it, using an index of the regions kept next to the source file')
+    parser.add_argument('--region-ordinal', dest='region_ordinal', type=int, default=None, metavar='N',
+                        help='write only the HTML of the N\'th region of the source file, counting from 1, as for '
+                             '--region')
+    parser.add_argument('--format', dest='format', choices=['html', 'json'], default='html',
+                        help='write an HTML guide (html), or the structure of the guide as a stream of JSON '
+                             'objects, one per line, for other tools to read (json) (default: %(default)s)')
+    parser.add_argument('--json-markdown', dest='json_markdown', default=False, action='store_true',
+                        help='with --format json, also write the intro, outro and explanations rendered from '
+                             'Markdown as XHTML')
+    parser.add_argument('-O', '--output-transform', dest='output_transform_fn', nargs=2, metavar=('REGEX','SUBSTITUTION'),
+                        default=None,
+                        help='convert multiple source files, naming each output file by regex substitution of its '
+                             'source file name.  Directories are searched for files that match REGEX')
+    parser.add_argument('--site', dest='site_index', default=None, metavar='INDEX',
+                        help='with --output-transform, also write a page INDEX that lists the converted guides and '
+                             'lets readers search their explanations, and the search index next to it')
+    parser.add_argument('--site-title', dest='site_title', default='Guides', metavar='TITLE',
+                        help='the title of the --site index page (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None, metavar='N',
+                        help='convert multiple source files in N parallel processes (default: one per CPU)')
+    parser.add_argument('-s', '--stream', dest='stream', default=False, action='store_true',
+                        help='render the source as it is read, in constant memory, instead of parsing it all '
+                             'before rendering.  Cannot be used with --output-transform or --step-table, and does '
+                             'not use the cache')
+    parser.add_argument('-w', '--watch', dest='watch', default=False, action='store_true',
+                        help='after converting, keep watching the source files and convert each one again '
+                             'whenever it changes, until interrupted')
+    parser.add_argument('--watch-interval', dest='watch_interval', type=float, default=0.25, metavar='SECONDS',
+                        help='how often to check whether watched files have changed (default: %(default)s)')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None, metavar='DIR',
+                        help='cache rendered guides in directory DIR (default: $XDG_CACHE_HOME/code-guide)')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=100, metavar='MB',
+                        help='evict the least recently used guides when the cache exceeds MB megabytes.  With '
+                             '--cache-fragments, the guides and their fragments each have half (default: %(default)s)')
+    parser.add_argument('--no-cache', dest='use_cache', default=True, action='store_false',
+                        help='always render guides, without reading or writing the cache')
+    parser.add_argument('--profile', dest='profile', default=False, action='store_true',
+                        help='report the time spent in each stage of conversion, and counts of the work done, '
+                             'on stderr')
+    parser.add_argument('--profile-format', dest='profile_format', choices=['text', 'json'], default=None,
+                        help='report the profile as text or as a JSON object (default: text).  Implies --profile')
+    parser.add_argument('sources', nargs='*', default=[], metavar='file',
                         help='source file of example code (default: read from stdin)')
     
     args = parser.parse_args(argv[1:])
     
-    if not _only_extract_resources(args):
-        to_html(lines_to_tagged_tree(lines(sys.stdin if use_stdio(args.source) else open(args.source, "r")), args.comment_start),
-                resource_dir=args.resource_dir,
-                syntax_highlight=args.syntax_highlight,
-                link_transform_fn=identity if args.link_transform_fn is None else re_subn(*args.link_transform_fn),
-                out=XMLGenerator(sys.stdout if use_stdio(args.output) else open(args.output, "w")))
+    profile = Profile() if args.profile or args.profile_format is not None else None
+    
+    try:
+        _run(parser, args, profile)
+    except MarkupError as e:
+        parser.exit(1, "%s: %s\n" % (parser.prog, e))
+    finally:
+        if profile is not None:
+            _report_profile(profile, args.profile_format)
+
+
+def _report_profile(profile, format):
+    if format == "json":
+        sys.stderr.write(json.dumps(profile.as_dict(), sort_keys=True) + "\n")
+    else:
+        sys.stderr.write(profile.summary())
+
+
+def _run(parser, args, profile=None):
+    link_transform_fn = identity if args.link_transform_fn is None else re_subn(*args.link_transform_fn)
+    
+    if args.region is not None or args.region_ordinal is not None:
+        _run_region(parser, args, link_transform_fn, profile)
+        return
+    
+    if args.format == "json":
+        _run_json(parser, args, link_transform_fn, profile)
+        return
+    
+    options = _conversion_options(comment_start=args.comment_start,
+                                  syntax_highlight=args.syntax_highlight,
+                                  resource_dir=args.resource_dir,
+                                  link_transform_fn=link_transform_fn,
+                                  resources=args.resources,
+                                  compact_highlighting=args.compact_highlighting,
+                                  cache_fragments=args.cache_fragments,
+                                  step_table=args.step_table)
+    
+    if args.use_cache:
+        from code_guide.cache import DiskCache, default_cache_dir
+        # The guides and their fragments are cached separately, and share the cache size
+        cache_size = args.cache_size*1024*1024
+        cache = DiskCache(args.cache_dir or default_cache_dir(),
+                          max_size=cache_size // 2 if args.cache_fragments else cache_size)
+    else:
+        cache = None
+    
+    if args.cache_fragments:
+        if args.compact_highlighting or args.step_table:
+            parser.error("cannot use --cache-fragments with --compact-highlighting or --step-table")
+        from code_guide.cache import process_fragment_cache
+        fragment_cache = process_fragment_cache(cache)
+    else:
+        fragment_cache = None
+    
+    if args.stream and args.step_table:
+        parser.error("cannot use --stream with --step-table, which holds every explanation until the end")
+    
+    if args.site_index is not None and args.output_transform_fn is None:
+        parser.error("--site needs --output-transform")
+    
+    if args.output_transform_fn is not None:
+        if args.output is not None:
+            parser.error("cannot use --output with --output-transform")
+        if args.stream:
+            parser.error("cannot use --stream with --output-transform")
+        
+        output_transform_fn = re_subn(*args.output_transform_fn)
+        conversions = list(batch_sources(args.sources, output_transform_fn))
+        for source, output in conversions:
+            if source == output:
+                parser.error("output transform does not rename " + source)
+        
+        for output in convert_files(conversions, options, jobs=args.jobs, cache=cache, profile=profile):
+            pass
+        
+        outputs = [output for source, output in conversions]
+        
+        if args.site_index is not None:
+            from code_guide.site import update_site
+            update_site(args.site_index, conversions, comment_start=args.comment_start, title=args.site_title,
+                        resource_dir=args.resource_dir, resources=args.resources,
+                        syntax_highlight=args.syntax_highlight)
+            outputs.append(args.site_index)
+        
+        if args.extract_resources:
+            for d in set(resource_dir_for(output, args.resource_dir) for output in outputs):
+                _extract_resources_for(args, d)
+        
+        if args.watch:
+            _watch(lambda: batch_sources(args.sources, output_transform_fn), options, cache, args.watch_interval,
+                   profile)
+        
+        return
+    
+    if len(args.sources) > 1:
+        parser.error("use --output-transform to convert multiple source files")
+    
+    source = args.sources[0] if args.sources else None
+    
+    if args.watch and (use_stdio(source) or use_stdio(args.output)):
+        parser.error("--watch needs a source file and an --output file")
+    
+    syntax_highlight, comment_start = detect_language(None if use_stdio(source) else source,
+                                                      args.syntax_highlight, args.comment_start)
+    
+    if args.stream and not _only_extract_resources(args):
+        if use_stdio(source):
+            input = tempfile.TemporaryFile()
+            copyfileobj(sys.stdin, input)
+            input.seek(0)
+        else:
+            input = open(source, "r")
+        
+        with input, output_file(args.output) as output:
+            try:
+                stream_file_to_html(input, comment_start=comment_start,
+                                    resource_dir=args.resource_dir,
+                                    syntax_highlight=syntax_highlight,
+                                    link_transform_fn=link_transform_fn,
+                                    out=BufferedXMLGenerator(output),
+                                    profile=profile,
+                                    resources=args.resources,
+                                    compact_highlighting=args.compact_highlighting,
+                                    step_table=args.step_table)
+            except MarkupError as e:
+                raise MarkupError(e.lineno, e.description, "<stdin>" if use_stdio(source) else source)
+    elif not (use_stdio(source) or use_stdio(args.output)):
+        convert_file(source, args.output, options, cache=cache, profile=profile)
+    elif not _only_extract_resources(args):
+        try:
+            if use_stdio(source):
+                tree = lines_to_tagged_tree(lines(sys.stdin), comment_start, profile=profile)
+            else:
+                with open(source, "r") as input:
+                    tree = lines_to_tagged_tree(lines(input), comment_start, profile=profile)
+        except MarkupError as e:
+            raise MarkupError(e.lineno, e.description, "<stdin>" if use_stdio(source) else source)
+        
+        with output_file(args.output) as output:
+            to_html(tree,
+                    resource_dir=args.resource_dir,
+                    syntax_highlight=syntax_highlight,
+                    link_transform_fn=link_transform_fn,
+                    out=BufferedXMLGenerator(output),
+                    profile=profile,
+                    resources=args.resources,
+                    compact_highlighting=args.compact_highlighting,
+                    fragment_cache=fragment_cache,
+                    step_table=args.step_table)
     
     if args.extract_resources:
-        extract_resources(args.output, args.resource_dir)
+        _extract_resources_for(args, resource_dir_for(args.output, args.resource_dir))
+    
+    if args.watch:
+        _watch(lambda: [(source, args.output)], options, cache, args.watch_interval, profile)
+
+
+def _extract_resources_for(args, d):
+    if args.resources == "bundle":
+        from code_guide.bundle import write_bundles
+        write_bundles(d)
+    elif args.resources == "link":
+        extract_resources_to(d, minified=True if args.only_used_resources else None)
+
+
+def _run_region(parser, args, link_transform_fn, profile=None):
+    from code_guide.regions import render_region, RegionNotFound
+    
+    if args.region is not None and args.region_ordinal is not None:
+        parser.error("cannot use --region with --region-ordinal")
+    if len(args.sources) != 1 or use_stdio(args.sources[0]) or args.output_transform_fn is not None:
+        parser.error("--region needs a single source file")
+    
+    n, by = (args.region, "index") if args.region is not None else (args.region_ordinal, "ordinal")
+    
+    try:
+        with output_file(args.output) as output:
+            render_region(args.sources[0], n, by,
+                          out=BufferedXMLGenerator(output),
+                          comment_start=args.comment_start,
+                          syntax_highlight=args.syntax_highlight,
+                          link_transform_fn=link_transform_fn,
+                          profile=profile)
+    except RegionNotFound as e:
+        parser.exit(1, "%s: %s\n" % (parser.prog, e.args[0]))
+
+
+def _run_json(parser, args, link_transform_fn, profile=None):
+    from code_guide.export import export_events, write_ndjson
+    
+    if len(args.sources) > 1 or args.output_transform_fn is not None:
+        parser.error("--format json converts a single source file")
+    
+    source = args.sources[0] if args.sources else None
+    comment_start = detect_language(None if use_stdio(source) else source, args.syntax_highlight, args.comment_start)[1]
+    
+    input = sys.stdin if use_stdio(source) else open(source, "r")
+    try:
+        with output_file(args.output) as output, (profile or _no_profile).timer("export"):
+            write_ndjson(export_events(iter_lines(input), comment_start,
+                                       markdown=args.json_markdown,
+                                       link_transform_fn=link_transform_fn,
+                                       profile=profile),
+                         output if profile is None else _ProfiledFile(output, profile))
+    except MarkupError as e:
+        raise MarkupError(e.lineno, e.description, "<stdin>" if use_stdio(source) else source)
+    finally:
+        if input is not sys.stdin:
+            input.close()
+
+
+def _watch(conversions, options, cache, interval, profile=None):
+    """Converts source files again whenever they change, reporting each conversion on stderr"""
+    outputs = {}
+    
+    def sources():
+        outputs.clear()
+        outputs.update(conversions())
+        return outputs.keys()
+    
+    for source in changed_files(sources, interval):
+        start = time.time()
+        try:
+            convert_file(source, outputs[source], options, cache=cache, profile=profile)
+        except MarkupError as e:
+            sys.stderr.write("code-guide: %s\n" % e)
+        except (IOError, OSError, UnicodeError) as e:
+            sys.stderr.write("code-guide: cannot convert %s: %s\n" % (source, e))
+        else:
+            sys.stderr.write("code-guide: converted %s to %s in %d ms\n" % 
+                             (source, outputs[source], (time.time() - start) * 1000))
@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+
+"""Benchmarks for code-guide.  Run with:  python -m code_guide.benchmark"""
+
+import sys
+import os
+import re
+import io
+import time
+import argparse
+import shutil
+import subprocess
+import tempfile
+import json
+import zlib
+from xml.sax.saxutils import XMLGenerator
+import pygments.lexers
+from code_guide import lines_to_tagged_tree, to_html, Renderer, lines, line, identity, MarkdownCache, BufferedXMLGenerator, \
+    tree_events, markdown_converter
+from code_guide.events import start
+# The internals that the benchmarks compare with the code they replaced
+from code_guide import _code_text, _highlight_each_line, _highlight_whole_file, _parse_lines, _parsed_line, \
+    _intro_group, _start_group, _end_group, _line_group
+
+
+def python_source(line_count):
+    """Generates a Python source of roughly line_count lines with nested explanations"""
+    chunk = ['#| A function that does something.',
+             'def f{n}(x):',
+             '    """Docstring for f{n}',
+             '    ',
+             '    spanning several lines',
+             '    """',
+             '    #| Loop over the input',
+             '    for i in range(x):',
+             '        print "value %d" % (i * {n})',
+             '    #|.',
+             '    return x + {n}',
+             '#|.',
+             '']
+
+    source = [l.format(n=i) for i in range(line_count // len(chunk) + 1) for l in chunk][:line_count]
+    open_regions = sum(1 if l.strip().startswith("#| ") else -1 if l.strip() == "#|." else 0 for l in source)
+    
+    return source + ["#|."] * open_regions
+
+
+def flat_source(line_count):
+    """Generates a source of line_count lines of code with a single explanation"""
+    return ['#|| A large file with almost no explanation'] + \
+        ['x{n} = f(x{m}, "some text", {n}) # a comment'.format(n=i, m=i-1) for i in range(line_count - 1)]
+
+
+def nested_source(line_count, depth=50):
+    """Generates a source of roughly line_count lines, in regions nested depth deep"""
+    chunk = [l for d in range(depth) for l in ['#| Region at depth %d' % d, 'x = %d' % d]] + \
+        ['#|.' for d in range(depth)]
+    
+    return chunk * max(1, line_count // len(chunk))
+
+
+def explained_source(line_count):
+    """Generates a source of roughly line_count lines, each with a long Markdown explanation"""
+    chunk = ['#| Step {n} uses *emphasis*, `code` and a [link](http://example.com/{n}).',
+             '#| ',
+             '#| A second paragraph:',
+             '#| ',
+             '#|  * with a list',
+             '#|  * of **several** items',
+             'step({n})',
+             '#|.']
+    
+    return [l.format(n=i) for i in range(max(1, line_count // len(chunk))) for l in chunk]
+
+
+def small_sources(line_count, lines_per_file=26):
+    """Generates roughly line_count lines of Python source, split into many small files"""
+    return [python_source(lines_per_file) for i in range(max(1, line_count // lines_per_file))]
+
+
+corpora = {
+    "flat": lambda n: [flat_source(n)],
+    "nested": lambda n: [nested_source(n)],
+    "explained": lambda n: [explained_source(n)],
+    "small-files": small_sources,
+    "python": lambda n: [python_source(n - n % 13)]
+}
+
+
+def example_sources(line_count):
+    """The example sources in the code-guide source tree, repeated to roughly line_count lines"""
+    examples_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "examples")
+    comment_starts = {".py": "#", ".java": "//"}
+
+    if not os.path.isdir(examples_dir):
+        return
+
+    for f in sorted(os.listdir(examples_dir)):
+        ext = os.path.splitext(f)[1]
+        if ext in comment_starts:
+            with open(os.path.join(examples_dir, f)) as input:
+                example = lines(input)
+            yield f, (example * (line_count // len(example) + 1))[:line_count], comment_starts[ext]
+
+
+def timed(fn, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best, 1e-9)
+
+
+def render(tree, **kwargs):
+    to_html(tree, BufferedXMLGenerator(io.BytesIO()), **kwargs)
+
+
+def lex(tree, highlight):
+    lexer = pygments.lexers.get_lexer_by_name("python")
+    for tokens in highlight([_code_text(e.text) for e in tree_events(tree.children) if type(e) == line], lexer):
+        pass
+
+
+def bench_highlighting(args):
+    tree = lines_to_tagged_tree(python_source(args.lines))
+
+    print "highlighting %d lines" % args.lines
+    for stage, each_line_fn, whole_file_fn in [
+            ("lexing", lambda: lex(tree, _highlight_each_line), lambda: lex(tree, _highlight_whole_file)),
+            ("rendering", lambda: render(tree, whole_file_highlighting=False), lambda: render(tree))]:
+        each_line = timed(each_line_fn, args.repeat)
+        whole_file = timed(whole_file_fn, args.repeat)
+        print "  %-10s each line: %8.3fs   whole file: %8.3fs   speedup: %6.2fx" % (
+            stage, each_line, whole_file, each_line / whole_file)
+
+
+def bench_output_size(args):
+    """Compares the size and lxml parse time of the HTML written in each highlighting mode"""
+    import lxml.html
+    
+    sources = [("python", python_source(args.lines - args.lines % 13)), ("explained", explained_source(args.lines))]
+    
+    print "HTML output size and parse time"
+    for name, source in sources:
+        tree = lines_to_tagged_tree(source)
+        print "  %s (%d bytes of source)" % (name, len("\n".join(source)))
+        for mode, options in [("standard", {}), ("compact", {"compact_highlighting": True}),
+                              ("step table", {"step_table": True})]:
+            buf = io.BytesIO()
+            to_html(tree, BufferedXMLGenerator(buf), **options)
+            html = buf.getvalue()
+            elapsed = timed(lambda: lxml.html.document_fromstring(html), args.repeat)
+            print "    %-12s %10d bytes %10d gzipped %8.3fs to parse" % (
+                mode, len(html), len(zlib.compress(html, 6)), elapsed)
+
+
+def bench_editing(args):
+    """Times rendering a guide again after an edit, with and without a FragmentCache"""
+    from code_guide.cache import FragmentCache
+    
+    source = python_source(args.lines - args.lines % 13)
+    middle = [i for i, l in enumerate(source) if l.startswith("#| ")][len(source) // 26]
+    edits = iter(range(args.repeat * 2))
+    
+    def edited():
+        result = list(source)
+        result[middle] += " (edit %d)" % next(edits)
+        return result
+    
+    fragment_cache = FragmentCache()
+    render(lines_to_tagged_tree(source), fragment_cache=fragment_cache)
+    
+    whole = timed(lambda: render(lines_to_tagged_tree(edited())), args.repeat)
+    fragments = timed(lambda: render(lines_to_tagged_tree(edited()), fragment_cache=fragment_cache), args.repeat)
+    
+    print "rendering %d lines again after editing one explanation" % len(source)
+    print "  whole guide: %8.3fs   cached fragments: %8.3fs   speedup: %6.2fx" % (whole, fragments, whole / fragments)
+
+
+def bench_threads(args):
+    """Renders small guides with a shared Renderer on pools of threads"""
+    import threading
+    import Queue
+    
+    sources = small_sources(args.lines)
+    renderer = Renderer()
+    d = tempfile.mkdtemp()
+    
+    def render_all(thread_count):
+        work = Queue.Queue()
+        for i, source in enumerate(sources):
+            work.put((i, source))
+        
+        def worker():
+            while True:
+                try:
+                    i, source = work.get_nowait()
+                except Queue.Empty:
+                    return
+                with open(os.path.join(d, "%d.html" % i), "wb") as out:
+                    renderer.render_to(source, out)
+        
+        threads = [threading.Thread(target=worker) for t in range(thread_count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    
+    try:
+        print "rendering %d guides with a shared Renderer" % len(sources)
+        for thread_count in [1, 2, 4, 8]:
+            elapsed = timed(lambda: render_all(thread_count), args.repeat)
+            print "  %d threads %8.3fs   %8.1f guides/s" % (thread_count, elapsed, len(sources) / elapsed)
+    finally:
+        shutil.rmtree(d)
+
+
+class CountingFile(object):
+    """Counts the calls made to write to a file"""
+    def __init__(self, f):
+        self.f = f
+        self.writes = 0
+    
+    def write(self, data):
+        self.writes += 1
+        self.f.write(data)
+
+
+def bench_writing(args):
+    tree = lines_to_tagged_tree(python_source(args.lines - args.lines % 13))
+    
+    print "writing %d lines to a file" % args.lines
+    for name, generator in [("unbuffered", XMLGenerator), ("buffered", BufferedXMLGenerator)]:
+        with tempfile.TemporaryFile() as f:
+            out = CountingFile(f)
+            elapsed = timed(lambda: to_html(tree, generator(out)), args.repeat)
+        print "  %-10s %8.3fs   %8d writes per guide" % (name, elapsed, out.writes // args.repeat)
+
+
+def parse_lines_with_separate_patterns(lines, comment_start):
+    """The line classifier that code-guide used to use, which tries each pattern in turn"""
+    comment_start_re = re.escape(comment_start)
+    intro_pattern = re.compile(r'^\s*' + comment_start_re + '\|\|(\s*| (?P<text>.+?))$')
+    region_start_pattern = re.compile(r'^\s*' + comment_start_re + '\|(( \[(?P<index>[0-9]+)\]\s*)? (?P<text>.*?))?$')
+    region_end_pattern = re.compile(r'^\s*' + comment_start_re + '\|\.\s*$')
+
+    line_groups = [
+        (intro_pattern, _intro_group),
+        (region_end_pattern, _end_group),
+        (region_start_pattern, _start_group)]
+
+    def parse_line(l, lineno):
+        for pattern, group_fn in line_groups:
+            m = pattern.match(l)
+            if m is not None:
+                return _parsed_line(group_fn, l, m.groupdict(), lineno)
+        else:
+            return _parsed_line(_line_group, l, {}, lineno)
+
+    return (parse_line(l, lineno) for lineno, l in enumerate(lines, 1))
+
+
+def classify(parse_lines, source, comment_start):
+    for parsed in parse_lines(source, comment_start):
+        pass
+
+
+def bench_classifier(args):
+    sources = list(example_sources(args.lines)) + [("generated.py", python_source(args.lines), "#")]
+
+    print "classifying %d lines" % args.lines
+    for name, source, comment_start in sources:
+        separate = timed(lambda: classify(parse_lines_with_separate_patterns, source, comment_start), args.repeat)
+        combined = timed(lambda: classify(_parse_lines, source, comment_start), args.repeat)
+        print "  %-16s separate patterns: %8.3fs   combined: %8.3fs   speedup: %6.2fx" % (
+            name, separate, combined, separate / combined)
+
+
+def time_to_first_byte(argv, input=None):
+    """Runs the command line in a new process and returns the time to its first byte of output"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + 
+        filter(None, [os.environ.get("PYTHONPATH")])))
+    
+    start = time.time()
+    p = subprocess.Popen([sys.executable, "-c", "import sys, code_guide; code_guide.cli(sys.argv)"] + argv,
+                         stdin=subprocess.PIPE if input is not None else None, 
+                         stdout=subprocess.PIPE, env=env)
+    if input is not None:
+        p.stdin.write(input)
+        p.stdin.close()
+    p.stdout.read(1)
+    elapsed = time.time() - start
+    
+    p.stdout.read()
+    if p.wait() != 0:
+        raise Exception("code-guide %s failed with status %d" % (" ".join(argv), p.returncode))
+    
+    return elapsed
+
+
+def bench_startup(args):
+    small_file = "\n".join(python_source(52)) + "\n"
+    
+    def extract_only():
+        d = tempfile.mkdtemp()
+        try:
+            return time_to_first_byte(["-x", "-r", d])
+        finally:
+            shutil.rmtree(d)
+    
+    print "time to first byte"
+    for name, fn in [("--help", lambda: time_to_first_byte(["--help"])),
+                     ("convert 52 lines", lambda: time_to_first_byte(["--no-cache"], input=small_file)),
+                     ("extract resources", extract_only)]:
+        print "  %-20s %8.3fs" % (name, min(fn() for i in range(args.repeat)))
+
+
+def explanation_texts(tree):
+    return [e.text for e in tree_events(tree.children) if type(e) == start and e.text] + \
+        [t for t in [tree.intro, tree.outro] if t]
+
+
+def convert_markdown(texts):
+    md = markdown_converter(identity)
+    for text in texts:
+        md.convert(text)
+        md.reset()
+
+
+def peak_memory(corpus, line_count):
+    """Renders a corpus in a new process and returns its peak memory in megabytes"""
+    script = ("import io, resource\n"
+              "from code_guide import lines_to_tagged_tree, to_html, BufferedXMLGenerator\n"
+              "from code_guide.benchmark import corpora\n"
+              "for source in corpora[%r](%d):\n"
+              "    to_html(lines_to_tagged_tree(source), BufferedXMLGenerator(io.BytesIO()))\n"
+              "print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n") % (corpus, line_count)
+    
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))] + 
+        filter(None, [os.environ.get("PYTHONPATH")])))
+    
+    return int(subprocess.check_output([sys.executable, "-c", script], env=env)) / 1024.0
+
+
+def bench_pipeline(args):
+    """Times each stage of the pipeline on each synthetic corpus"""
+    results = {}
+    stages = ["parse", "highlight", "markdown", "serialize", "total"]
+    
+    print "pipeline throughput in lines/s, %d lines per corpus" % args.lines
+    print "  %-12s" % "" + "".join("%12s" % s for s in stages) + "%12s" % "peak MB"
+    
+    for name in sorted(corpora):
+        sources = corpora[name](args.lines)
+        line_count = sum(len(source) for source in sources)
+        trees = [lines_to_tagged_tree(source) for source in sources]
+        texts = [explanation_texts(tree) for tree in trees]
+        
+        warm_cache = MarkdownCache(max_entries=sum(len(t) for t in texts) + 1)
+        for tree in trees:
+            render(tree, syntax_highlight="text", markdown_cache=warm_cache)
+        
+        times = {
+            "parse": lambda: [lines_to_tagged_tree(source) for source in sources],
+            "highlight": lambda: [lex(tree, _highlight_whole_file) for tree in trees],
+            "markdown": lambda: [convert_markdown(t) for t in texts],
+            "serialize": lambda: [render(tree, syntax_highlight="text", markdown_cache=warm_cache) for tree in trees],
+            "total": lambda: [render(lines_to_tagged_tree(source), markdown_cache=MarkdownCache()) for source in sources]
+        }
+        
+        result = dict((stage, line_count / timed(times[stage], args.repeat)) for stage in stages)
+        result["peak_memory_mb"] = peak_memory(name, args.lines)
+        results[name] = result
+        
+        print "  %-12s" % name + "".join("%12d" % result[s] for s in stages) + "%12.1f" % result["peak_memory_mb"]
+    
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change in each result from its baseline and returns the regressions"""
+    regressions = []
+    
+    print "change from baseline"
+    for benchmark in sorted(results):
+        for corpus in sorted(results[benchmark]):
+            for metric, value in sorted(results[benchmark][corpus].items()):
+                try:
+                    base = baseline[benchmark][corpus][metric]
+                except KeyError:
+                    continue
+                
+                change = (value - base) * 100.0 / base if base else 0.0
+                worse = change > tolerance if metric == "peak_memory_mb" else change < -tolerance
+                if worse:
+                    regressions.append((benchmark, corpus, metric))
+                
+                print "  %-40s %+8.1f%%%s" % ("%s/%s/%s" % (benchmark, corpus, metric), change, 
+                                              "  REGRESSION" if worse else "")
+    
+    return regressions
+
+
+benchmarks = {
+    "highlighting": bench_highlighting,
+    "classifier": bench_classifier,
+    "startup": bench_startup,
+    "pipeline": bench_pipeline,
+    "writing": bench_writing,
+    "output-size": bench_output_size,
+    "threads": bench_threads,
+    "editing": bench_editing
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Run code-guide benchmarks")
+    parser.add_argument('-n', '--lines', dest='lines', type=int, default=5000,
+                        help='number of lines in generated sources (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='report the best of REPEAT runs (default: %(default)s)')
+    parser.add_argument('--save-baseline', dest='save_baseline', default=None, metavar='FILE',
+                        help='save the results as a JSON baseline to compare later runs against')
+    parser.add_argument('--baseline', dest='baseline', default=None, metavar='FILE',
+                        help='compare the results with the baseline saved in FILE, exiting with status 1 '
+                             'if any are worse by more than the tolerance')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=10, metavar='PERCENT',
+                        help='how much worse than the baseline a result can be (default: %(default)s%%)')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', default=sorted(benchmarks),
+                        help='benchmarks to run, from: %s (default: all)' % ", ".join(sorted(benchmarks)))
+
+    args = parser.parse_args(argv[1:])
+
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error("unknown benchmark: " + name)
+
+    results = {}
+    for name in args.benchmarks:
+        result = benchmarks[name](args)
+        if result is not None:
+            results[name] = result
+    
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
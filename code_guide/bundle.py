@@ -0,0 +1,186 @@
+"""Bundles the stylesheets and scripts that guides use into one stylesheet and one script"""
+
+import os
+import re
+import base64
+import hashlib
+import mimetypes
+import posixpath
+import code_guide
+from code_guide import resource_data
+
+
+# The classes used in the HTML that code-guide generates.  Classes used by
+# the scripts are found by scanning the scripts themselves.
+_page_classes = frozenset("""
+btn btn-primary bootstro colophon
+code-guide-code code-guide-intro code-guide-outro
+form-search search-query code-guide-search code-guide-index
+""".split())
+
+# The Bootstrap plugins that bootstro uses to show explanations
+_bootstrap_plugins = frozenset(["transition", "tooltip", "popover"])
+
+# Stylesheets for classes that are generated from the code, so cannot be pruned
+_unpruned_stylesheets = frozenset(["pygments.css"])
+_bootstrap_script = "bootstrap/js/bootstrap.min.js"
+
+
+def _minified(resources):
+    """The minified versions of the stylesheets or scripts that pages link to"""
+    return [r.format(min=".min") for r in resources]
+
+
+def _bootstrap_js(js):
+    """Removes the plugins that guides do not use from the minified Bootstrap script"""
+    header = _licence.match(js)
+    header = header.group(0) if header else ""
+    
+    plugins = [p + "}(window.jQuery)" for p in js[len(header):].strip().rstrip(";").split("}(window.jQuery),")]
+    plugins[-1] = plugins[-1][:-len("}(window.jQuery)")]
+
+    def name(plugin):
+        if "e.support.transition=" in plugin:
+            return "transition"
+        m = re.search(r"e\.fn\.(\w+)=function", plugin)
+        return m and m.group(1)
+
+    return header + ",".join(p for p in plugins if name(p) in _bootstrap_plugins) + ";"
+
+
+def _script_words(scripts):
+    return frozenset(re.findall(r"[A-Za-z_][\w-]*", "\n".join(scripts)))
+
+
+_comment = re.compile(r"/\*.*?\*/", re.S)
+_licence = re.compile(r"/\*!.*?\*/", re.S)
+
+def minify_css(css):
+    """Removes comments, other than /*! licences */, and unnecessary whitespace from CSS"""
+    licences = _licence.findall(css)
+    css = _comment.sub("", css)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};:,>])\s*", r"\1", css)
+    css = css.replace(";}", "}")
+    return "".join(licences) + css.strip()
+
+
+def _css_blocks(css):
+    """Splits comment-free CSS into (prelude, body) pairs, with a body of None for statements"""
+    blocks = []
+    depth = 0
+    start = 0
+    body_start = None
+    i = 0
+    while i < len(css):
+        c = css[i]
+        if c in "\"'":
+            i = css.index(c, i + 1)
+        elif c == "{":
+            if depth == 0:
+                body_start = i + 1
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                blocks.append((css[start:body_start - 1].strip(), css[body_start:i]))
+                start = i + 1
+        elif c == ";" and depth == 0:
+            blocks.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return blocks
+
+
+_class_selector = re.compile(r"\.(-?[_a-zA-Z][\w-]*)")
+
+def prune_css(css, used_classes):
+    """Removes the selectors of classes that are not used, and the rules left empty, from CSS"""
+    rules = []
+    keyframes = []
+    for prelude, body in _css_blocks(css):
+        if body is None:
+            rules.append(prelude + ";")
+        elif prelude.startswith("@media"):
+            inner = prune_css(body, used_classes)
+            if inner:
+                rules.append(prelude + "{" + inner + "}")
+        elif re.match(r"@(-\w+-)?keyframes", prelude):
+            keyframes.append((prelude.split()[-1], prelude + "{" + body + "}"))
+        elif prelude.startswith("@"):
+            rules.append(prelude + "{" + body + "}")
+        else:
+            selectors = [s for s in prelude.split(",") if set(_class_selector.findall(s)) <= used_classes]
+            if selectors:
+                rules.append(",".join(selectors) + "{" + body + "}")
+
+    kept = "".join(rules)
+    return kept + "".join(k for name, k in keyframes if re.search(r"\b" + re.escape(name) + r"\b", kept))
+
+
+def _inline_urls(css, stylesheet):
+    """Replaces the URLs of resources that a stylesheet refers to with data URIs"""
+    def data_uri(m):
+        url = m.group(2)
+        if ":" in url:
+            return m.group(0)
+        r = posixpath.normpath(posixpath.join(posixpath.dirname(stylesheet), url))
+        content_type = mimetypes.guess_type(r)[0] or "application/octet-stream"
+        return 'url("data:%s;base64,%s")' % (content_type, base64.b64encode(resource_data(r)))
+
+    return re.sub(r"""url\((["']?)([^"')]+)\1\)""", data_uri, css)
+
+
+_bundles = {}
+
+def _bundle(kind):
+    try:
+        return _bundles[kind]
+    except KeyError:
+        scripts = [_bootstrap_js(resource_data(r)) if r == _bootstrap_script else resource_data(r)
+                   for r in _minified(code_guide._scripts)]
+
+        if kind == "js":
+            text = "\n;".join(scripts)
+            # Escaped so that the script can be written into any page, whatever its encoding
+            text = re.sub(r"</(script)", r"<\/\1", text, flags=re.I)
+            text = re.sub(u"[^\\x00-\\x7f]", lambda m: "\\u%04x" % ord(m.group(0)), text.decode("utf-8")).encode("ascii")
+        else:
+            used = _page_classes | _script_words(scripts)
+            stylesheets = []
+            for r in _minified(code_guide._stylesheets):
+                css = minify_css(resource_data(r))
+                licences = "".join(_licence.findall(css))
+                css = css[len(licences):]
+                if r not in _unpruned_stylesheets:
+                    css = prune_css(css, used)
+                css = _inline_urls(css, r)
+                stylesheets.append(licences + css)
+            text = "\n".join(stylesheets)
+
+        if "]]>" in text or re.search(r"</style", text, re.I):
+            raise ValueError("cannot write the %s bundle into a page" % kind)
+
+        _bundles[kind] = text
+        return text
+
+
+def css():
+    """The bundled stylesheet"""
+    return _bundle("css")
+
+def js():
+    """The bundled script"""
+    return _bundle("js")
+
+
+def bundle_name(kind):
+    """The file name of the css or js bundle, which contains a hash of its content"""
+    return "code-guide-%s.%s" % (hashlib.sha1(_bundle(kind)).hexdigest()[:12], kind)
+
+
+def write_bundles(d):
+    """Writes the bundled stylesheet and script to directory d"""
+    code_guide.ensure_dir(d)
+    for kind in ["css", "js"]:
+        code_guide.write_if_changed(os.path.join(d, bundle_name(kind)), _bundle(kind))
@@ -0,0 +1,203 @@
+"""Caches of rendered guides and of the fragments of guides"""
+
+import os
+import stat
+import hashlib
+import threading
+from collections import OrderedDict
+import code_guide
+
+
+def default_cache_dir():
+    return os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "code-guide")
+
+
+def _transform_key(fn):
+    if fn is code_guide.identity:
+        return "identity"
+    elif isinstance(fn, code_guide.RegexSubstitution):
+        return repr(fn)
+    else:
+        raise ValueError("cannot derive a cache key from link transform " + repr(fn))
+
+
+def render_key(source, options):
+    """The cache key for rendering the source text with the given _conversion_options"""
+    import pygments
+    import markdown
+    
+    h = hashlib.sha1()
+    for part in [code_guide.__version__,
+                 pygments.__version__,
+                 getattr(markdown, "version", None) or markdown.__version__,
+                 options.comment_start,
+                 options.syntax_highlight,
+                 options.resource_dir,
+                 options.resources,
+                 str(options.compact_highlighting),
+                 str(options.cache_fragments),
+                 str(options.step_table),
+                 _transform_key(options.link_transform_fn)]:
+        h.update(part.encode("utf-8") if isinstance(part, unicode) else part)
+        h.update("\0")
+    h.update(source)
+    return h.hexdigest()
+
+
+class DiskCache(object):
+    """A directory of cached data, one file per key, that evicts the least recently used entries"""
+
+    def __init__(self, directory, max_size=100*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return data
+
+    def put(self, key, data):
+        try:
+            code_guide.ensure_dir(self.directory)
+            code_guide.write_atomically(self._path(key), data)
+        except (IOError, OSError):
+            return
+        
+        # The directory is only scanned when the size written since the last 
+        # scan could have taken the cache over its limit
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            full = self._size is None or self._size > self.max_size
+        
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is 10% below its limit"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        
+        entries = []
+        for name in names:
+            if name.startswith("."):
+                continue
+            try:
+                st = os.stat(self._path(name))
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for mtime, size, name in entries)
+        if total > self.max_size:
+            for mtime, size, name in sorted(entries):
+                if total <= self.max_size - self.max_size // 10:
+                    break
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+                total -= size
+        
+        with self._lock:
+            self._size = total
+
+
+def fragment_settings_key(syntax_highlight, link_transform_fn, whole_file_highlighting=True):
+    """The part of the cache keys of fragments that is derived from the settings they are rendered with"""
+    import pygments
+    import markdown
+    
+    return "\0".join([code_guide.__version__,
+                      pygments.__version__,
+                      getattr(markdown, "version", None) or markdown.__version__,
+                      syntax_highlight,
+                      _transform_key(link_transform_fn),
+                      str(whole_file_highlighting)])
+
+
+class FragmentCache(object):
+    """A thread-safe LRU memo of the HTML of fragments of guides, saved to store if given"""
+    
+    def __init__(self, max_entries=4096, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._unsaved = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            html = self._entries.pop(key, None)
+            if html is not None:
+                self._entries[key] = html
+                self.hits += 1
+                return html
+        
+        data = None if self.store is None else self.store.get(key)
+        
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            else:
+                self.hits += 1
+        
+        html = data.decode("utf-8")
+        self._remember(key, html)
+        return html
+    
+    def put(self, key, html):
+        self._remember(key, html)
+        if self.store is not None:
+            with self._lock:
+                self._unsaved[key] = html
+    
+    def _remember(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def save(self):
+        """Saves the fragments that have been put since the last save to the store"""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+        
+        for key, html in unsaved.items():
+            self.store.put(key, html.encode("utf-8"))
+
+
+_process_fragment_caches = {}
+_process_fragment_caches_lock = threading.Lock()
+
+def process_fragment_cache(cache=None):
+    """The FragmentCache of this process for guides cached in cache"""
+    directory = None if cache is None else os.path.join(cache.directory, "fragments")
+    with _process_fragment_caches_lock:
+        fragment_cache = _process_fragment_caches.get(directory)
+        if fragment_cache is None:
+            store = None if cache is None else DiskCache(directory, max_size=cache.max_size)
+            fragment_cache = _process_fragment_caches[directory] = FragmentCache(store=store)
+        return fragment_cache
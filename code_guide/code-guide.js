@@ -1,12 +1,73 @@
 
 var code_guide = {
+	/* Starts explaining the code.  If the page has a step table, bootstro is 
+	   given the regions in the order of the table, and each region is given 
+	   its explanation only when it is shown. */
 	start: function() {
-		bootstro.start('.bootstro',
+		var table = document.getElementById('code-guide-steps');
+		var regions = '.bootstro';
+		
+		if (table !== null) {
+			code_guide._steps = code_guide._steps || $.parseJSON($(table).text().replace(/^\s*<!\[CDATA\[|\]\]>\s*$/g, ''));
+			regions = $($.map(code_guide._steps, function(step) { return document.getElementById(step.id); }));
+			bootstro.on_step(code_guide._showStep);
+		}
+		
+		bootstro.start(regions,
 			{
 				nextButton: '<button class="btn btn-primary btn-mini bootstro-next-btn">Next <i class="icon-arrow-right"></i></button>',
 				prevButton: '<button class="btn btn-primary btn-mini bootstro-prev-btn"><i class="icon-arrow-left"></i> Prev</button>',
 				finishButton: '<button class="btn btn-mini btn-success bootstro-finish-btn"><i class="icon-ok"></i> Close explanation</button>'
 			});
-	}
+	},
+	
+	/* Shows the items of a site index whose guides contain words that start 
+	   with every word typed into the search input.  The search index is 
+	   loaded from the URL in the input's data-search-index attribute the 
+	   first time it is needed. */
+	search: function(input, list) {
+		var query = input.value.toLowerCase().match(/[a-z0-9_]+/g) || [];
+		var url = $(input).attr('data-search-index');
+		
+		code_guide._searchIndexes[url] = code_guide._searchIndexes[url] || $.getJSON(url);
+		code_guide._searchIndexes[url].done(function(index) {
+			var matches = null;
+			
+			$.each(query, function(i, prefix) {
+				var found = {};
+				$.each(index.words, function(word, guides) {
+					if (word.lastIndexOf(prefix, 0) === 0) {
+						$.each(guides, function(j, guide) { found[guide] = true; });
+					}
+				});
+				if (matches !== null) {
+					$.each(matches, function(guide) {
+						if (!found[guide]) { delete matches[guide]; }
+					});
+				}
+				else {
+					matches = found;
+				}
+			});
+			
+			$(list).children('li').each(function() {
+				$(this).toggle(matches === null || matches[$(this).attr('data-guide')] === true);
+			});
+		});
+	},
+	
+	_showStep: function(event) {
+		var step = code_guide._steps[event.idx];
+		$(document.getElementById(step.id)).attr({
+			'data-bootstro-content': step.content,
+			'data-bootstro-html': 'true',
+			'data-bootstro-placement': 'right',
+			'data-bootstro-width': '25%'
+		});
+	},
+	
+	_steps: null,
+	
+	_searchIndexes: {}
 };
 
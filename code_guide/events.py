@@ -0,0 +1,17 @@
+"""The events that guides are parsed into, and the nodes of the parsed tree"""
+
+from collections import namedtuple
+
+
+root = namedtuple('root', ['children', 'intro', 'outro'])
+explanation = namedtuple('explanation', ['text', 'index', 'children'])
+line = namedtuple('line', ['text'])
+intro = namedtuple('intro', ['text', 'lineno'])
+
+start = namedtuple('start', ['text', 'index', 'lineno'])
+end = namedtuple('end', ['lineno'])
+
+# A region found by the parser: its ordinal in document order, counting from 1,
+# the line numbers of its start and end markup, and the ordinal of the region 
+# that encloses it, or None.
+region = namedtuple('region', ['ordinal', 'index', 'text', 'start', 'end', 'depth', 'parent'])
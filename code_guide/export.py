@@ -0,0 +1,65 @@
+"""Exports the structure of a guide as JSON objects, one per line"""
+
+import json
+from code_guide import parse_events, identity, default_markdown_cache, MarkupError, markdown_converter, counted_events
+from code_guide.events import intro, start, end
+
+
+def _last_lineno(e):
+    return e.lineno + e.text.count("\n")
+
+
+def export_events(lines, comment_start="#", markdown=False, link_transform_fn=identity, markdown_cache=None,
+                  profile=None):
+    """Lazily parses lines into intro, outro, start, line and end objects"""
+    events = parse_events(lines, comment_start)
+    if profile is not None:
+        events = counted_events(events, profile)
+    
+    if markdown:
+        md = markdown_converter(link_transform_fn)
+        markdown_cache = default_markdown_cache if markdown_cache is None else markdown_cache
+
+    def with_html(obj, text):
+        if markdown:
+            obj["html"] = markdown_cache.xhtml(md, link_transform_fn, text, profile)
+        return obj
+
+    open_regions = []
+    ordinal = 0
+    lineno = 1
+    intro_type = "intro"
+
+    for e in events:
+        t = type(e)
+        if t == intro:
+            if open_regions:
+                raise MarkupError(e.lineno, "introduction inside a region")
+            yield with_html({"type": intro_type, "text": e.text, "lineno": e.lineno, "end": _last_lineno(e)}, e.text)
+            intro_type = "outro"
+            lineno = _last_lineno(e) + 1
+        elif t == start:
+            ordinal += 1
+            yield with_html({"type": "start", "text": e.text, "index": e.index, "ordinal": ordinal,
+                             "depth": len(open_regions), "parent": open_regions[-1][0] if open_regions else None,
+                             "lineno": e.lineno, "end": _last_lineno(e)}, e.text)
+            open_regions.append((ordinal, e.lineno))
+            lineno = _last_lineno(e) + 1
+        elif t == end:
+            if not open_regions:
+                raise MarkupError(e.lineno, "end of region that has not been started")
+            yield {"type": "end", "ordinal": open_regions.pop()[0], "lineno": e.lineno}
+            lineno = e.lineno + 1
+        else:
+            yield {"type": "line", "text": e.text, "lineno": lineno}
+            lineno += 1
+
+    if open_regions:
+        raise MarkupError(open_regions[-1][1], "region is not ended")
+
+
+def write_ndjson(objects, out):
+    """Writes each object to the binary file out as a line of JSON"""
+    for obj in objects:
+        out.write(json.dumps(obj, sort_keys=True, separators=(",", ":")))
+        out.write("\n")
@@ -0,0 +1,129 @@
+"""Renders a single region of a guide, using an index of the regions kept next to the source"""
+
+import os
+import sys
+import io
+import json
+import code_guide
+from code_guide import lines_to_tagged_tree, lines, detect_language, identity, BufferedXMLGenerator, MarkupError, \
+    write_code, _no_profile
+from code_guide.events import explanation
+
+
+_index_suffix = ".code-guide-regions"
+
+
+class RegionNotFound(KeyError):
+    pass
+
+
+def region_index_path(source):
+    """The path of the hidden region index of a source file"""
+    d, name = os.path.split(source)
+    return os.path.join(d, "." + name + _index_suffix)
+
+
+def _lines_with_offsets(input, offsets):
+    """Yields the lines of a binary file, appending the offset of each line to offsets"""
+    offset = 0
+    for l in input:
+        offsets.append(offset)
+        offset += len(l)
+        yield l.rstrip('\n')
+    offsets.append(offset)
+
+
+def build_region_index(source, comment_start):
+    """Returns an index of the regions of a source file"""
+    st = os.stat(source)
+    offsets = []
+    regions = []
+
+    with open(source, "rb") as input:
+        try:
+            lines_to_tagged_tree(_lines_with_offsets(input, offsets), comment_start, regions=regions)
+        except MarkupError as e:
+            raise MarkupError(e.lineno, e.description, source)
+
+    return {"version": code_guide.__version__,
+            "comment_start": comment_start,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "regions": [dict(r._asdict(), start_offset=offsets[r.start - 1], end_offset=offsets[r.end])
+                        for r in regions]}
+
+
+def _read_index(path):
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        return index if isinstance(index, dict) else None
+    except (IOError, ValueError):
+        return None
+
+
+def _is_current(index, source, comment_start):
+    st = os.stat(source)
+    return index is not None \
+        and index.get("version") == code_guide.__version__ \
+        and index.get("comment_start") == comment_start \
+        and index.get("size") == st.st_size \
+        and index.get("mtime") == st.st_mtime
+
+
+def region_index(source, comment_start):
+    """Returns the index of the regions of a source file, building and saving it if out of date"""
+    path = region_index_path(source)
+    index = _read_index(path)
+
+    if not _is_current(index, source, comment_start):
+        index = build_region_index(source, comment_start)
+        try:
+            code_guide.write_atomically(path, json.dumps(index, sort_keys=True))
+        except (IOError, OSError):
+            pass
+
+    return index
+
+
+def find_region(index, n, by="index"):
+    """Returns the region with index [n], or the n'th region if by is "ordinal", or raises RegionNotFound"""
+    if by not in ("index", "ordinal"):
+        raise ValueError("unknown way to find a region: " + repr(by))
+
+    for r in index["regions"]:
+        if r[by] == n:
+            return r
+
+    raise RegionNotFound("no region with %s %d" % (by, n))
+
+
+def render_region(source, n, by="index", out=None, comment_start=None, syntax_highlight=None,
+                  link_transform_fn=identity, markdown_cache=None, profile=None):
+    """Writes the HTML of a region of a source file within the regions that enclose it"""
+    syntax_highlight, comment_start = detect_language(source, syntax_highlight, comment_start)
+
+    if out is None:
+        out = BufferedXMLGenerator(sys.stdout)
+
+    with (profile or _no_profile).timer("region index"):
+        index = region_index(source, comment_start)
+    r = find_region(index, n, by)
+
+    with open(source, "rb") as input:
+        input.seek(r["start_offset"])
+        text = input.read(r["end_offset"] - r["start_offset"])
+
+    try:
+        tree = lines_to_tagged_tree(lines(io.BytesIO(text)), comment_start, profile=profile)
+    except MarkupError as e:
+        raise MarkupError(e.lineno + r["start"] - 1, e.description, source)
+
+    children = tree.children
+    ancestor = r["parent"]
+    while ancestor is not None:
+        a = index["regions"][ancestor - 1]
+        children = [explanation(text=a["text"], index=a["index"], children=children)]
+        ancestor = a["parent"]
+
+    write_code(out, children, syntax_highlight, link_transform_fn, markdown_cache, profile)
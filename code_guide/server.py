@@ -0,0 +1,319 @@
+"""A web server that renders example code as guides.  Run with:  code-guide serve DIR"""
+
+import os
+import sys
+import io
+import gzip
+import hashlib
+import mimetypes
+import threading
+import urllib
+import urlparse
+import argparse
+import Queue
+import BaseHTTPServer
+from collections import namedtuple, OrderedDict
+from xml.sax.saxutils import XMLGenerator
+import code_guide
+from code_guide import lines, identity, re_subn, element, MarkupError, detect_language, Renderer
+
+
+resource_path = "/_code_guide/"
+
+
+_page = namedtuple('_page', ['content_type', 'body', 'etag'])
+
+def _page_of(content_type, body):
+    return _page(content_type=content_type, body=body, etag='"' + hashlib.sha1(body).hexdigest() + '"')
+
+
+class _Rendering(object):
+    def __init__(self, stamp, source_hash, page):
+        self.stamp = stamp
+        self.source_hash = source_hash
+        self.page = page
+
+
+class GuideRenderer(object):
+    """Renders source files as guides, rendering each again only when it changes"""
+
+    def __init__(self, syntax_highlight=None, comment_start=None, link_transform_fn=identity, max_entries=1024):
+        self.syntax_highlight = syntax_highlight
+        self.comment_start = comment_start
+        self.link_transform_fn = link_transform_fn
+        self.max_entries = max_entries
+        self._renderings = OrderedDict()
+        self._renderers = {}
+        self._lock = threading.Lock()
+
+    def page(self, path):
+        st = os.stat(path)
+        stamp = (st.st_mtime, st.st_size)
+
+        with self._lock:
+            rendering = self._renderings.pop(path, None)
+            if rendering is not None:
+                self._renderings[path] = rendering
+
+        if rendering is not None and rendering.stamp == stamp:
+            return rendering.page
+
+        with open(path, "rb") as f:
+            source = f.read()
+        source_hash = hashlib.sha1(source).hexdigest()
+
+        if rendering is not None and rendering.source_hash == source_hash:
+            page = rendering.page
+        else:
+            page = _page_of("text/html", self.render(source, path))
+
+        with self._lock:
+            self._renderings.pop(path, None)
+            self._renderings[path] = _Rendering(stamp, source_hash, page)
+            while len(self._renderings) > self.max_entries:
+                self._renderings.popitem(last=False)
+
+        return page
+
+    def render(self, source, path=None):
+        return self._renderer(path).render(lines(io.BytesIO(source)))
+    
+    def _renderer(self, path):
+        language = detect_language(path, self.syntax_highlight, self.comment_start)
+        
+        with self._lock:
+            renderer = self._renderers.get(language)
+        
+        if renderer is None:
+            syntax_highlight, comment_start = language
+            renderer = Renderer(syntax_highlight=syntax_highlight,
+                                comment_start=comment_start,
+                                resource_dir=resource_path,
+                                link_transform_fn=self.link_transform_fn)
+            with self._lock:
+                renderer = self._renderers.setdefault(language, renderer)
+        
+        return renderer
+
+
+_resource_pages = {}
+
+def _resource_page(name):
+    try:
+        return _resource_pages[name]
+    except KeyError:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        page = _resource_pages[name] = _page_of(content_type, code_guide.resource_data(name))
+        return page
+
+
+def _directory_page(dirpath, urlpath):
+    out = io.BytesIO()
+    gen = XMLGenerator(out)
+    title = "Index of " + urlpath
+
+    gen.startElement("html", {})
+    gen.startElement("head", {})
+    element(gen, "title", {}, text=title)
+    gen.endElement("head")
+    gen.startElement("body", {})
+    element(gen, "h1", {}, text=title)
+    gen.startElement("ul", {})
+    for name in sorted(os.listdir(dirpath)):
+        if name.startswith("."):
+            continue
+        if os.path.isdir(os.path.join(dirpath, name)):
+            name += "/"
+        gen.startElement("li", {})
+        element(gen, "a", {"href": urllib.quote(name)}, text=name)
+        gen.endElement("li")
+    gen.endElement("ul")
+    gen.endElement("body")
+    gen.endElement("html")
+
+    return _page_of("text/html", out.getvalue())
+
+
+class GuideRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves guides rendered from the files beneath the server's root, and their resources"""
+
+    server_version = "code-guide/" + code_guide.__version__
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body):
+        urlpath = urllib.unquote(urlparse.urlsplit(self.path).path)
+
+        try:
+            page = self.page(urlpath)
+        except MarkupError as e:
+            self.send_error(500, str(e))
+            return
+        except (IOError, OSError):
+            page = None
+
+        if page is None:
+            self.send_error(404)
+            return
+
+        gzipped = _accepts_gzip(self.headers.get("Accept-Encoding", ""))
+        etag = _gzipped_etag(page) if gzipped else page.etag
+
+        if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+
+        body = _gzipped(page) if gzipped else page.body
+
+        self.send_response(200)
+        self.send_header("Content-Type", page.content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Vary", "Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(body)
+
+    def page(self, urlpath):
+        if urlpath.startswith(resource_path):
+            name = os.path.normpath(urlpath[len(resource_path):]).replace(os.sep, "/")
+            if name.startswith("..") or not code_guide.is_html_resource(name):
+                return None
+            return _resource_page(name)
+
+        root = self.server.root
+        path = os.path.normpath(os.path.join(root, urlpath.lstrip("/")))
+        if path != root and not path.startswith(os.path.join(root, "")):
+            return None
+
+        if os.path.isdir(path):
+            if not urlpath.endswith("/"):
+                return None
+            return _directory_page(path, urlpath)
+        else:
+            return self.server.renderer.page(path)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def _accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header gives gzip a quality above zero"""
+    qualities = {}
+    for coding in accept_encoding.split(","):
+        params = coding.split(";")
+        name = params[0].strip().lower()
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            qualities[name] = q
+    
+    return qualities.get("gzip", qualities.get("x-gzip", qualities.get("*", 0.0))) > 0
+
+
+def _gzipped_etag(page):
+    return page.etag[:-1] + '-gzip"'
+
+
+_gzipped_bodies = OrderedDict()
+_gzipped_bodies_max_entries = 1024
+_gzipped_lock = threading.Lock()
+
+def _gzipped(page):
+    with _gzipped_lock:
+        body = _gzipped_bodies.pop(page.etag, None)
+        if body is not None:
+            _gzipped_bodies[page.etag] = body
+            return body
+    
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as f:
+        f.write(page.body)
+    body = buf.getvalue()
+    
+    with _gzipped_lock:
+        _gzipped_bodies[page.etag] = body
+        while len(_gzipped_bodies) > _gzipped_bodies_max_entries:
+            _gzipped_bodies.popitem(last=False)
+    return body
+
+
+class GuideServer(BaseHTTPServer.HTTPServer):
+    """An HTTP server that handles requests on a fixed pool of threads"""
+
+    allow_reuse_address = True
+
+    def __init__(self, address, root, renderer, threads=8, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, GuideRequestHandler)
+        self.root = os.path.abspath(root)
+        self.renderer = renderer
+        self.verbose = verbose
+        self._requests = Queue.Queue()
+        for i in range(threads):
+            t = threading.Thread(target=self._handle_requests)
+            t.daemon = True
+            t.start()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _handle_requests(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+def serve_cli(argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]) + " serve",
+                                     description="Serve the example code in a directory as interactive HTML guides")
+
+    parser.add_argument('-l', '--highlight', dest='syntax_highlight', default=None, metavar='LANGUAGE',
+                        help='apply syntax highlighting for language LANGUAGE (default: detected from the name of '
+                             'each source file, or python)')
+    parser.add_argument('-c', '--comment-start', dest='comment_start', default=None,
+                        help='the syntax used to start single-line comments (default: detected from the language)')
+    parser.add_argument('-t', '--link-transform', dest='link_transform_fn', nargs=2, metavar=('REGEX','SUBSTITUTION'),
+                        default=None,
+                        help='transform link URLs by regex substitution (default: no transforms are applied)')
+    parser.add_argument('-b', '--bind', dest='host', default='127.0.0.1', metavar='ADDRESS',
+                        help='listen on ADDRESS (default: %(default)s)')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=8000,
+                        help='listen on port PORT (default: %(default)s)')
+    parser.add_argument('-j', '--threads', dest='threads', type=int, default=8, metavar='N',
+                        help='handle requests on a pool of N threads (default: %(default)s)')
+    parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
+                        help='log every request')
+    parser.add_argument('root', nargs='?', default='.', metavar='DIR',
+                        help='the directory of example code to serve (default: the current directory)')
+
+    args = parser.parse_args(argv[2:])
+
+    renderer = GuideRenderer(syntax_highlight=args.syntax_highlight,
+                             comment_start=args.comment_start,
+                             link_transform_fn=identity if args.link_transform_fn is None else re_subn(*args.link_transform_fn))
+    server = GuideServer((args.host, args.port), args.root, renderer, threads=args.threads, verbose=args.verbose)
+
+    sys.stderr.write("code-guide: serving %s at http://%s:%d/\n" % (args.root, args.host, server.server_address[1]))
+    server.serve_forever()
@@ -0,0 +1,161 @@
+"""A page that lists a site of guides, and a search index of their explanations"""
+
+import os
+import re
+import io
+import json
+import hashlib
+import urllib
+import code_guide
+from code_guide import lines_to_tagged_tree, lines, detect_language, identity, element, title_of, \
+    default_markdown_cache, BufferedXMLGenerator, markdown_converter, tree_events, write_resource_links, flush_output
+from code_guide.events import start
+
+
+search_index_name = "search-index.json"
+_site_state_name = ".code-guide-site.json"
+
+_summary_length = 200
+
+_stopwords = frozenset("""
+a an and are as at be but by for from has have if in into is it its of on or so
+that the their then there these this to was were which will with
+""".split())
+
+
+def words(text):
+    """The distinct words in text that are worth searching for"""
+    return set(w for w in re.findall(r"[a-z0-9_]+", text.lower()) if len(w) > 1 and w not in _stopwords)
+
+
+def _plain_text(md, text):
+    if not text:
+        return None
+    return "".join(default_markdown_cache.element(md, identity, text, "code-guide-text").itertext()).strip()
+
+
+def index_guide(source_lines, comment_start="#"):
+    """Returns the title, summary and searchable words of a guide"""
+    tree = lines_to_tagged_tree(source_lines, comment_start)
+    md = markdown_converter(identity)
+
+    intro_etree = None if not tree.intro else default_markdown_cache.element(md, identity, tree.intro, "code-guide-intro")
+    title = title_of(intro_etree)
+    intro = None if intro_etree is None else "".join(intro_etree.itertext()).strip()
+    if intro and title and intro.startswith(title):
+        intro = intro[len(title):].strip()
+
+    texts = [title, intro, _plain_text(md, tree.outro)] + \
+        [_plain_text(md, e.text) for e in tree_events(tree.children) if type(e) == start]
+
+    return {
+        "title": title,
+        "summary": intro if intro is None or len(intro) <= _summary_length else intro[:_summary_length].rstrip() + u"\u2026",
+        "words": sorted(set.union(set(), *[words(t) for t in texts if t]))
+    }
+
+
+def search_index(guides):
+    """Builds the index of words that code-guide.js searches"""
+    postings = {}
+    for i, guide in enumerate(guides):
+        for w in guide["words"]:
+            postings.setdefault(w, []).append(i)
+
+    return {"guides": [[g["url"], g["title"] or g["url"]] for g in guides],
+            "words": postings}
+
+
+def _source_key(text, syntax_highlight, comment_start):
+    h = hashlib.sha1()
+    h.update(code_guide.__version__ + "\0" + syntax_highlight + "\0" + comment_start + "\0")
+    h.update(text)
+    return h.hexdigest()
+
+
+def _read_state(path):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        return state if isinstance(state, dict) and state.get("version") == code_guide.__version__ else {}
+    except (IOError, ValueError):
+        return {}
+
+
+def _url(path, index_dir):
+    return urllib.pathname2url(os.path.relpath(path, index_dir or "."))
+
+
+def write_index_page(out, guides, title="Guides", resource_dir="", minified=True, resources="link"):
+    """Writes a page that lists the guides, with a search box"""
+    out.startElement("html", {})
+
+    out.startElement("head", {})
+    element(out, "title", {}, text=title)
+    write_resource_links(out, resource_dir, minified, resources)
+    out.endElement("head")
+
+    out.startElement("body", {})
+    element(out, "h1", {}, text=title)
+
+    out.startElement("form", {"class": "form-search code-guide-search", "onsubmit": "return false"})
+    element(out, "input", {"type": "text",
+                           "class": "search-query",
+                           "placeholder": "Search",
+                           "data-search-index": search_index_name,
+                           "oninput": "code_guide.search(this, '.code-guide-index')"})
+    out.endElement("form")
+
+    out.startElement("ul", {"class": "code-guide-index"})
+    for i, guide in enumerate(guides):
+        out.startElement("li", {"data-guide": str(i)})
+        element(out, "a", {"href": guide["url"]}, text=guide["title"] or guide["url"])
+        if guide["summary"]:
+            element(out, "p", {}, text=guide["summary"])
+        out.endElement("li")
+    out.endElement("ul")
+
+    out.endElement("body")
+    out.endElement("html")
+    flush_output(out)
+
+
+def update_site(index_path, conversions, comment_start=None, title="Guides", resource_dir="", minified=True,
+                resources="link", syntax_highlight=None):
+    """Writes the index page and search index of the guides, returning the sources indexed again"""
+    index_dir = os.path.dirname(index_path)
+    state_path = os.path.join(index_dir, _site_state_name)
+    state = _read_state(state_path)
+    previous = state.get("guides", {})
+
+    indexed = []
+    guides = {}
+
+    for source, output in conversions:
+        source_syntax_highlight, source_comment_start = detect_language(source, syntax_highlight, comment_start)
+        with open(source, "rb") as input:
+            text = input.read()
+        key = _source_key(text, source_syntax_highlight, source_comment_start)
+
+        guide = previous.get(source)
+        if guide is None or guide.get("key") != key:
+            guide = index_guide(lines(io.BytesIO(text)), source_comment_start)
+            guide["key"] = key
+            indexed.append(source)
+
+        guide["url"] = _url(output, index_dir)
+        guides[source] = guide
+
+    ordered = sorted(guides.values(), key=lambda g: ((g["title"] or g["url"]).lower(), g["url"]))
+
+    page = io.BytesIO()
+    write_index_page(BufferedXMLGenerator(page), ordered, title, resource_dir, minified, resources)
+
+    code_guide.ensure_dir(index_dir)
+    code_guide.write_if_changed(index_path, page.getvalue())
+    code_guide.write_if_changed(os.path.join(index_dir, search_index_name),
+                                json.dumps(search_index(ordered), separators=(",", ":"), sort_keys=True))
+    code_guide.write_atomically(state_path, json.dumps({"version": code_guide.__version__, "guides": guides},
+                                                       sort_keys=True))
+
+    return indexed
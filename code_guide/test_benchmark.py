@@ -0,0 +1,36 @@
+import pytest
+from code_guide import lines_to_tagged_tree
+from code_guide.benchmark import python_source, bench_highlighting, benchmarks, main
+
+
+class Args(object):
+    lines = 200
+    repeat = 1
+
+
+def test_generated_python_sources_are_well_formed_wherever_they_are_cut_off():
+    for n in range(1, 30):
+        lines_to_tagged_tree(python_source(n))
+
+
+def test_highlighting_benchmark_runs(capsys):
+    bench_highlighting(Args())
+    
+    assert "speedup" in capsys.readouterr()[0]
+
+
+@pytest.mark.parametrize("name", sorted(benchmarks))
+def test_each_benchmark_runs(name, capsys):
+    main(["benchmark", "-n", "200", "-r", "1", name])
+    
+    assert capsys.readouterr()[0]
+
+
+def test_results_can_be_compared_with_a_saved_baseline(tmpdir, capsys):
+    baseline = str(tmpdir.join("baseline.json"))
+    main(["benchmark", "-n", "200", "-r", "1", "--save-baseline", baseline, "pipeline"])
+    
+    with pytest.raises(SystemExit):
+        main(["benchmark", "-n", "200", "-r", "1", "--baseline", baseline, "--tolerance", "-1000", "pipeline"])
+    
+    assert "REGRESSION" in capsys.readouterr()[0]
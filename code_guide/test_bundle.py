@@ -0,0 +1,86 @@
+import io
+import os
+import lxml.etree
+import code_guide
+import code_guide.bundle as bundle_module
+from lxml.etree import XPathElementEvaluator
+from code_guide import lines_to_tagged_tree, to_html, BufferedXMLGenerator
+from code_guide.bundle import prune_css, minify_css, css, js, bundle_name, write_bundles
+
+
+def test_minifying_css_keeps_licences():
+    assert minify_css("/*! licence */\n/* comment */\na , b {\n  color : red ;\n}\n") == "/*! licence */a,b{color:red}"
+
+
+def test_pruning_css_removes_selectors_of_unused_classes():
+    pruned = prune_css(".used{color:red}.unused{color:blue}.used,.unused{margin:0}p{padding:0}", set(["used"]))
+
+    assert pruned == ".used{color:red}.used{margin:0}p{padding:0}"
+
+
+def test_pruning_css_removes_empty_media_queries_and_unused_keyframes():
+    pruned = prune_css("@media print{.unused{color:red}}@media print{.used{color:red}}"
+                       "@keyframes spin{from{top:0}}@keyframes fade{from{top:0}}.used{animation:fade 1s}",
+                       set(["used"]))
+
+    assert pruned == "@media print{.used{color:red}}.used{animation:fade 1s}@keyframes fade{from{top:0}}"
+
+
+def test_bundles_leave_out_unused_parts_of_bootstrap():
+    assert ".btn-primary" in css()
+    assert ".popover" in css()
+    assert ".carousel" not in css()
+    assert ".navbar" not in css()
+
+    assert "e.fn.popover=" in js()
+    assert "e.fn.modal=" not in js()
+
+
+def test_bundles_contain_the_stylesheets_and_scripts_that_pages_link_to(monkeypatch):
+    bootstro_js = code_guide.resource_data("bootstro.min.js").strip()[-100:]
+    assert bootstro_js in js()
+    
+    monkeypatch.setattr(bundle_module, "_bundles", {})
+    monkeypatch.setattr(code_guide, "_scripts", [s for s in code_guide._scripts if not s.startswith("bootstro")])
+    
+    assert bootstro_js not in js()
+
+
+def test_bundles_keep_the_styles_of_highlighted_code():
+    assert ".code-guide-syntax-k{" in css()
+
+
+def test_bundles_contain_the_images_that_stylesheets_refer_to():
+    assert "url(" in css()
+    assert "url(\"data:image/png;base64," in css()
+    assert "url(\"../img/" not in css()
+
+
+def render(resources):
+    out = io.BytesIO()
+    to_html(lines_to_tagged_tree(["#| Says hello", "print 'hello'", "#|."]),
+            out=BufferedXMLGenerator(out), resource_dir="res", resources=resources)
+    return XPathElementEvaluator(lxml.etree.fromstring(out.getvalue()))
+
+
+def test_inlined_resources_are_written_into_the_page():
+    page = render("inline")
+
+    assert page("//link") == []
+    assert page("//script/@src") == []
+    assert ".btn-primary" in page("string(//style)")
+    assert "code_guide" in page("string(//script)")
+
+
+def test_bundled_resources_are_linked_by_content_hash():
+    page = render("bundle")
+
+    assert page("//link/@href") == ["res/" + bundle_name("css")]
+    assert page("//script/@src") == ["res/" + bundle_name("js")]
+
+
+def test_writes_bundles(tmpdir):
+    write_bundles(str(tmpdir))
+
+    assert sorted(os.listdir(str(tmpdir))) == sorted([bundle_name("css"), bundle_name("js")])
+    assert tmpdir.join(bundle_name("js")).read() == js()
@@ -0,0 +1,156 @@
+import os
+import stat
+from code_guide import _conversion_options, convert_file, identity, re_subn
+from code_guide import write_if_changed
+from code_guide.cache import DiskCache, FragmentCache, render_key
+
+
+options = _conversion_options(comment_start="#", syntax_highlight="python", resource_dir="", link_transform_fn=identity)
+
+
+def test_cached_data_is_retrieved_by_key(tmpdir):
+    cache = DiskCache(str(tmpdir.join("cache")))
+    
+    assert cache.get("k") is None
+    cache.put("k", "data")
+    assert cache.get("k") == "data"
+
+
+def test_least_recently_used_entries_are_evicted_when_cache_is_full(tmpdir):
+    cache = DiskCache(str(tmpdir.join("cache")), max_size=10)
+    
+    cache.put("a", "1234")
+    os.utime(str(tmpdir.join("cache", "a")), (1000, 1000))
+    cache.put("b", "5678")
+    os.utime(str(tmpdir.join("cache", "b")), (2000, 2000))
+    cache.put("c", "9012")
+    
+    assert cache.get("a") is None
+    assert cache.get("b") == "5678"
+    assert cache.get("c") == "9012"
+
+
+def test_render_key_depends_on_source_and_options():
+    key = render_key("print 1", options)
+    
+    assert render_key("print 1", options) == key
+    assert render_key("print 2", options) != key
+    assert render_key("print 1", options._replace(comment_start="//")) != key
+    assert render_key("print 1", options._replace(syntax_highlight="ruby")) != key
+    assert render_key("print 1", options._replace(resource_dir="res")) != key
+    assert render_key("print 1", options._replace(cache_fragments=True)) != key
+    assert render_key("print 1", options._replace(link_transform_fn=re_subn("a", "b"))) != key
+    assert render_key("print 1", options._replace(link_transform_fn=re_subn("a", "b"))) == \
+           render_key("print 1", options._replace(link_transform_fn=re_subn("a", "b")))
+
+
+def test_unchanged_files_are_not_rewritten(tmpdir):
+    f = tmpdir.join("f.txt")
+    
+    assert write_if_changed(str(f), "content")
+    assert not write_if_changed(str(f), "content")
+    assert write_if_changed(str(f), "changed")
+    assert f.read() == "changed"
+
+
+def test_rendered_guides_are_cached(tmpdir):
+    cache = DiskCache(str(tmpdir.join("cache")))
+    source = tmpdir.join("example.py")
+    source.write("#|| Title\n#|| =====\n\nprint 'hello'\n")
+    output = tmpdir.join("example.html")
+    
+    convert_file(str(source), str(output), options, cache)
+    rendered = output.read()
+    
+    assert cache.get(render_key(source.read(), options)) == rendered
+    
+    output.remove()
+    cache.put(render_key(source.read(), options), "from the cache")
+    convert_file(str(source), str(output), options, cache)
+    
+    assert output.read() == "from the cache"
+
+
+def test_eviction_ignores_subdirectories(tmpdir):
+    cache = DiskCache(str(tmpdir.join("cache")), max_size=1)
+    tmpdir.join("cache", "fragments", "f").write("1234", ensure=True)
+    
+    cache.put("a", "1234")
+    
+    assert tmpdir.join("cache", "fragments", "f").read() == "1234"
+
+
+def test_fragments_are_saved_to_the_store(tmpdir):
+    store = DiskCache(str(tmpdir.join("fragments")))
+    fragments = FragmentCache(store=store)
+    
+    fragments.put("k", u"<div>\u00e9</div>")
+    assert store.get("k") is None
+    
+    fragments.save()
+    
+    assert FragmentCache(store=store).get("k") == u"<div>\u00e9</div>"
+    assert FragmentCache(store=store).get("other") is None
+
+
+def test_least_recently_used_fragments_are_discarded_from_memory():
+    fragments = FragmentCache(max_entries=2)
+    
+    fragments.put("a", u"A")
+    fragments.put("b", u"B")
+    fragments.get("a")
+    fragments.put("c", u"C")
+    
+    assert fragments.get("a") == u"A"
+    assert fragments.get("b") is None
+    assert fragments.get("c") == u"C"
+
+
+def test_cache_errors_are_treated_as_cache_misses(tmpdir):
+    tmpdir.join("not-a-directory").write("")
+    cache = DiskCache(str(tmpdir.join("not-a-directory", "cache")))
+    
+    cache.put("k", "data")
+    assert cache.get("k") is None
+
+
+def test_guides_are_converted_when_the_cache_cannot_be_written(tmpdir):
+    tmpdir.join("not-a-directory").write("")
+    cache = DiskCache(str(tmpdir.join("not-a-directory", "cache")))
+    source = tmpdir.join("example.py")
+    source.write("print 'hello'\n")
+    output = tmpdir.join("example.html")
+    
+    convert_file(str(source), str(output), options, cache)
+    
+    assert "hello" in output.read()
+
+
+def test_cache_directory_is_only_scanned_when_the_cache_could_be_full(tmpdir, monkeypatch):
+    cache = DiskCache(str(tmpdir.join("cache")), max_size=100)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(evict()))
+    
+    for key in "abcdefghij":
+        cache.put(key, "12345")
+    assert len(scans) == 1
+    
+    for key in "klmnopqrstu":
+        cache.put(key, "12345")
+    assert len(scans) == 2
+    assert sum(len(f.read()) for f in tmpdir.join("cache").listdir()) <= 90
+
+
+def test_files_are_written_with_the_mode_of_new_files_without_changing_the_umask(tmpdir, monkeypatch):
+    umask = os.umask(0)
+    os.umask(umask)
+    
+    def set_umask(mask):
+        raise AssertionError("umask changed")
+    monkeypatch.setattr(os, "umask", set_umask)
+    
+    f = tmpdir.join("f.txt")
+    write_if_changed(str(f), "content")
+    
+    assert stat.S_IMODE(os.stat(str(f)).st_mode) == 0666 & ~umask
@@ -1,12 +1,26 @@
 
 
+import sys
+import os
+import subprocess
+import zipfile
+import code_guide
 from code_guide import *
-from code_guide import _root, _explanation
+from code_guide.cache import FragmentCache
+from code_guide.benchmark import parse_lines_with_separate_patterns
+from code_guide import _root, _explanation, _conversion_options, _stream_highlighted_line, _highlight_each_line
 import io
+import json
+import threading
+import pytest
 import lxml.etree
 from lxml.etree import XPathElementEvaluator
 from lxml.sax import ElementTreeContentHandler
 from xml.sax.saxutils import XMLGenerator
+import markdown
+import pygments
+import pygments.lexers
+from pygments.formatters import HtmlFormatter
 
 def root(children, intro=None, outro=None):
     return _root(intro=intro, outro=outro, children=children)
@@ -254,6 +268,13 @@ def test_script_and_stylesheet_links_can_be_prefixed_with_resource_directory():
         assert generated("/html/head/link[@href=$href][@rel='stylesheet'][@type='text/css']", href="over/here/"+s)
 
 
+def test_colophon():
+    generated = io.BytesIO()
+    to_html(tree, XMLGenerator(generated))
+    
+    assert '<div class="colophon">\n         <p>Generated with' in generated.getvalue()
+
+
 def test_explain_button():
     generated = code_to_html(tree)
     
@@ -290,6 +311,53 @@ def test_explicit_ordering_as_html():
     assert generated("string(//*[@data-bootstro-step='1'])") == "l1\n"
 
 
+def step_table(generated):
+    return json.loads(generated("string(//script[@id='code-guide-steps'])"))
+
+def test_explanations_can_be_written_in_a_step_table():
+    generated = code_to_html(tree, step_table=True)
+    
+    assert generated("//@data-bootstro-content") == []
+    assert generated("//*[@class='bootstro']/@id") == ["code-guide-step-0", "code-guide-step-1", "code-guide-step-2"]
+    assert step_table(generated) == [{"id": "code-guide-step-0", "content": "<p>A</p>"},
+                                     {"id": "code-guide-step-1", "content": "<p>B</p>"},
+                                     {"id": "code-guide-step-2", "content": "<p>C</p>"}]
+
+
+def test_step_table_is_in_the_order_that_explanations_are_shown():
+    tree = root([
+            explanation("e2", index=2, children=[line("l1")]),
+            explanation("e1", index=1, children=[line("l2")]),
+            explanation("e3", children=[line("l3")])])
+    
+    generated = code_to_html(tree, step_table=True)
+    
+    assert [step["content"] for step in step_table(generated)] == ["<p>e1</p>", "<p>e2</p>", "<p>e3</p>"]
+
+
+def test_step_table_cannot_end_the_script_it_is_written_in():
+    b = io.BytesIO()
+    to_html(root([explanation("*a* & </script> ]]>", [line("l1")])]), XMLGenerator(b), step_table=True)
+    html = b.getvalue()
+    
+    table = html[html.index('<script type="application/json"'):]
+    table = table[table.index(">") + 1:table.index("</script>")]
+    assert table.startswith("<![CDATA[") and table.endswith("]]>")
+    assert json.loads(table[len("<![CDATA["):-len("]]>")])[0]["content"] == \
+        "<p><em>a</em> &amp; &lt;/script&gt; ]]&gt;</p>"
+
+
+def test_streamed_step_table_is_the_same_as_rendering_the_tree():
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines), XMLGenerator(expected), step_table=True)
+    
+    actual = io.BytesIO()
+    stream_to_html(parse_events(source_lines), XMLGenerator(actual), intro=first_intro(parse_events(source_lines)), 
+                   chunk_size=2, step_table=True)
+    
+    assert actual.getvalue() == expected.getvalue()
+
+
 def test_code_link_translation():
     tree = root(
         intro = "There is [example code](example2.py) here...",
@@ -304,6 +372,649 @@ def test_code_link_translation():
     assert generated("string(//a[@href='example3.html'])") == "more example code"
 
 
+def test_lexer_state_carries_across_lines():
+    tree = root([
+            line('s = """'),
+            explanation("inside a string", [
+                    line("if not code")]),
+            line('"""')])
+    
+    generated = code_to_html(tree)
+    
+    assert generated("//span[@class='code-guide-syntax-s'][text()='if not code']")
+
+
+def test_lines_can_be_highlighted_independently():
+    tree = root([
+            line('s = """'),
+            line("if not code"),
+            line('"""')])
+    
+    generated = code_to_html(tree, whole_file_highlighting=False)
+    
+    assert generated("//span[@class='code-guide-syntax-k'][text()='if']")
+
+
+crlf_source = ["\r", "#| Sets x\r", "x = 1\r", "#|.\r", "\r", "y = 2\r"]
+
+def code_text(html):
+    return XPathElementEvaluator(lxml.etree.fromstring(html))("string(//*[@class='code-guide-code'])")
+
+def test_blank_crlf_lines_are_highlighted_on_their_own_line():
+    html = io.BytesIO()
+    to_html(lines_to_tagged_tree(crlf_source), XMLGenerator(html))
+    
+    assert code_text(html.getvalue()) == " \nx = 1\n \ny = 2\n"
+
+
+def test_blank_crlf_lines_are_highlighted_on_their_own_line_in_cached_fragments():
+    assert code_text(render_with_fragment_cache(crlf_source, FragmentCache())) == " \nx = 1\n \ny = 2\n"
+
+
+def test_blank_crlf_lines_are_highlighted_on_their_own_line_when_streamed():
+    source = ["x = 1\r", "y = 2\r", "\r", "z = 3\r"]
+    html = io.BytesIO()
+    stream_to_html(parse_events(source), XMLGenerator(html), chunk_size=2)
+    
+    assert code_text(html.getvalue()) == "x = 1\ny = 2\n \nz = 3\n"
+
+
+def test_highlighted_lines_are_streamed_as_pygments_would_format_them():
+    lexer = pygments.lexers.get_lexer_by_name("python")
+    
+    for text in ['x = "a<b" & c  # comment', ' ', '    return [i for i in range(10) if i != "\'"]', '@decorated']:
+        expected = io.BytesIO()
+        stream_html(XMLGenerator(expected), pygments.highlight(text, lexer, HtmlFormatter(cssclass="", classprefix="code-guide-syntax-")))
+        
+        actual = io.BytesIO()
+        for tokens in _highlight_each_line([text], lexer):
+            _stream_highlighted_line(XMLGenerator(actual), tokens)
+        
+        assert actual.getvalue() == expected.getvalue()
+
+
+def test_compact_highlighting_gives_token_types_with_the_same_style_the_same_class():
+    tree = root([
+            line("def f(x):  # first"),
+            line("    return x  # second")])
+    
+    generated = code_to_html(tree, compact_highlighting=True)
+    
+    keywords = generated("//span[text()='def' or text()='return']/@class")
+    comments = generated("//span[starts-with(text(), '#')]/@class")
+    assert len(set(keywords)) == 1
+    assert len(set(comments)) == 1
+    assert keywords[0] != comments[0]
+    assert generated("//span[contains(@class, 'code-guide-syntax')]") == []
+    assert generated("string(//*[@class='code-guide-code'])").startswith("def f(x):  # first\n    return x  # second\n")
+
+
+def test_compact_highlighting_writes_a_stylesheet_of_only_the_styles_used():
+    generated = code_to_html(root([line("return x")]), compact_highlighting=True)
+    
+    keyword = generated("string(//span[text()='return']/@class)")
+    assert generated("string(//style)") == ".code-guide-code .%s{color: #008000; font-weight: bold}" % keyword
+
+
+def test_compact_highlighting_does_not_write_spans_for_tokens_without_style():
+    generated = code_to_html(root([line("x = y")]), compact_highlighting=True)
+    
+    assert [e.text for e in generated("//span")] == ["="]
+
+
+def test_markdown_conversions_are_memoized():
+    cache = MarkdownCache()
+    tree = root(
+        intro="The Title\n=========",
+        children=[
+            explanation("same text", [line("l1")]),
+            explanation("same text", [line("l2")]),
+            explanation("different text", [line("l3")])])
+    
+    code_to_html(tree, markdown_cache=cache)
+    assert (cache.hits, cache.misses) == (1, 4)
+    
+    generated = code_to_html(tree, markdown_cache=cache)
+    assert (cache.hits, cache.misses) == (5, 4)
+    assert generated("string(/html/head/title)") == "The Title"
+    
+    code_to_html(tree, markdown_cache=cache, link_transform_fn=re_subn("a", "b"))
+    assert (cache.hits, cache.misses) == (6, 8)
+
+
+def test_markdown_cache_discards_least_recently_used_conversions():
+    cache = MarkdownCache(max_entries=2)
+    convert = lambda text: cache.xhtml(markdown.Markdown(), identity, text)
+    
+    convert("a")
+    convert("b")
+    convert("a")
+    convert("c")
+    assert (cache.hits, cache.misses) == (1, 3)
+    
+    convert("a")
+    assert (cache.hits, cache.misses) == (2, 3)
+    
+    convert("b")
+    assert (cache.hits, cache.misses) == (2, 4)
+
+
+source_lines = [
+    "#|| Example Code",
+    "#|| ============",
+    "#|| Intro Text",
+    "l1",
+    "#| A",
+    "l2",
+    "",
+    "#| B",
+    "l3",
+    "#|.",
+    "#|.",
+    "#|| Ignored",
+    "l4",
+    "#|| That's all, folks!"]
+
+def test_streamed_html_is_the_same_as_rendering_the_tree():
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines), XMLGenerator(expected))
+    
+    actual = io.BytesIO()
+    stream_to_html(parse_events(source_lines), XMLGenerator(actual), intro=first_intro(parse_events(source_lines)), 
+                   chunk_size=2)
+    
+    assert actual.getvalue() == expected.getvalue()
+
+
+def test_streamed_file_is_the_same_as_rendering_the_tree(tmpdir):
+    source = tmpdir.join("example.py")
+    source.write("\n".join(source_lines) + "\n")
+    
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines), XMLGenerator(expected))
+    
+    actual = io.BytesIO()
+    with source.open() as input:
+        stream_file_to_html(input, XMLGenerator(actual))
+    
+    assert actual.getvalue() == expected.getvalue()
+
+
+def test_streaming_writes_code_before_the_rest_of_the_source_is_read():
+    out = io.BytesIO()
+    
+    def events():
+        for e in parse_events(["l1", "l2", "l3"]):
+            yield e
+        assert "l1" in out.getvalue()
+        for e in parse_events(["l4"]):
+            yield e
+    
+    stream_to_html(events(), XMLGenerator(out), chunk_size=2)
+    
+    assert "l4" in out.getvalue()
+
+
+def test_first_intro_reads_no_further_than_the_intro():
+    def events():
+        for e in parse_events(["l1", "#|| the intro"]):
+            yield e
+        assert False, "read beyond the intro"
+    
+    assert first_intro(events()) == "the intro"
+
+
+def test_markup_lines_are_classified_as_by_separate_patterns():
+    def classified(parse_lines, l, comment_start):
+        parsed = next(parse_lines([l], comment_start))
+        return parsed.group_fn.__name__, parsed.parts.get('text'), parsed.parts.get('index')
+    
+    for comment_start in ["#", "//", "--", "|"]:
+        for l in ["", "code", "x = 1 #| not markup", "#|", "#||", "#|| ", "#||  text", "#||text", "#|x", "#|.", "#|. ", 
+                  "#|.x", "#|..", "#| text", "#|  text", "  #| text", "#| [2] text", "#| [2]  text", "#| [2]", "#| [x] text", 
+                  "#|[2] text", "#| [2]text", "\t#|.\t", "#|| [1] not an index"]:
+            l = l.replace("#", comment_start)
+            
+            assert classified(code_guide._parse_lines, l, comment_start) == \
+                classified(parse_lines_with_separate_patterns, l, comment_start), l
+
+
+def test_compact_document_can_be_viewed_as_tree():
+    for source in [
+            source_lines,
+            [],
+            ["l1", "#| a", "#|."],
+            ["#| a", "  l1", "  #| b", "  #|.", "#|."],
+            ["#| a", "#|.", "#| b", "#|.", "l1"],
+            ["#| a", "l1", "  #| b", "  #|.", "#|.", "#| c", "#|.", "l2"],
+            ["#| a", "l0", "  #| b", "  l1", "    #| c", "    #|.", "  #|.", "#|.", "#| d", "l2", "#|."],
+            ["#| [2] a", "l1", "#|.", "#| [1] b", "l2", "#|.", "l3"],
+            ["#| [0] a", "l1", "#|.", "#| b", "l2", "#|."]]:
+        
+        compact = lines_to_tagged_tree(source, compact=True)
+        
+        assert compact.tree() == lines_to_tagged_tree(source)
+
+
+def test_regions_can_be_nested_to_any_depth():
+    depth = sys.getrecursionlimit() * 2
+    source = [l for i in range(depth) for l in ["#| region %d" % i, "line %d" % i]] + ["#|."] * depth
+    
+    for tree in [lines_to_tagged_tree(source), lines_to_tagged_tree(source, compact=True)]:
+        out = io.BytesIO()
+        to_html(tree, XMLGenerator(out))
+        assert out.getvalue().count('class="bootstro"') == depth
+    
+    out = io.BytesIO()
+    stream_to_html(parse_events(source), XMLGenerator(out))
+    assert out.getvalue().count('class="bootstro"') == depth
+
+
+def test_reports_unbalanced_region_markers_with_line_numbers():
+    for source, lineno, description in [
+            (["l1", "#| a", "l2", "#|.", "#|.", "l3"], 5, "end of region that has not been started"),
+            (["l1", "#| a", "l2", "  #| b", "  l3", "#|."], 2, "region is not ended"),
+            (["#| a", "#|| intro", "#|."], 2, "introduction inside a region")]:
+        
+        for parse in [lambda: lines_to_tagged_tree(source), 
+                      lambda: lines_to_tagged_tree(source, compact=True),
+                      lambda: stream_to_html(parse_events(source), XMLGenerator(io.BytesIO()))]:
+            try:
+                parse()
+                assert False, "should have raised MarkupError"
+            except MarkupError as e:
+                assert (e.lineno, e.description) == (lineno, description)
+                assert str(e) == "line %d: %s" % (lineno, description)
+
+
+def test_compact_document_is_stored_in_arrays():
+    compact = lines_to_tagged_tree(source_lines, compact=True)
+    
+    assert compact.intro == "Example Code\n============\nIntro Text"
+    assert compact.outro == "That's all, folks!"
+    assert [compact.line_text(i) for i in range(compact.line_count)] == ["l1", "l2", "", "l3", "l4"]
+    assert list(compact.region_start) == [1, 3]
+    assert list(compact.region_end) == [4, 4]
+    assert list(compact.region_depth) == [0, 1]
+    assert compact.region_text == ["A", "B"]
+
+
+def test_compact_document_rendered_as_html():
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines), XMLGenerator(expected))
+    
+    actual = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines, compact=True), XMLGenerator(actual))
+    
+    assert actual.getvalue() == expected.getvalue()
+
+
+def test_compact_document_is_highlighted_in_chunks(monkeypatch):
+    chunks = []
+    highlight = code_guide._highlight_whole_file
+    
+    def recording_highlight(texts, code_lexer):
+        chunks.append(len(texts))
+        return highlight(texts, code_lexer)
+    
+    monkeypatch.setattr(CompactDocument, "_chunk_lines", 2)
+    monkeypatch.setattr(code_guide, "_highlight_whole_file", recording_highlight)
+    
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines), XMLGenerator(expected))
+    del chunks[:]
+    
+    actual = io.BytesIO()
+    to_html(lines_to_tagged_tree(source_lines, compact=True), XMLGenerator(actual))
+    
+    assert actual.getvalue() == expected.getvalue()
+    assert max(chunks) <= 2 and sum(chunks) == 5
+
+
+def test_extracts_resources(tmpdir):
+    extract_resources_to(str(tmpdir))
+    
+    for r in scripts + stylesheets + ["jquery-1.9.1.js", "bootstrap/img/glyphicons-halflings.png"]:
+        assert tmpdir.join(r).check(file=1)
+
+
+def test_extracts_only_the_resources_used_by_generated_html(tmpdir):
+    extract_resources_to(str(tmpdir), minified=True)
+    
+    for r in scripts + stylesheets + ["bootstrap/img/glyphicons-halflings.png"]:
+        assert tmpdir.join(r).check(file=1)
+    
+    assert not tmpdir.join("jquery-1.9.1.js").check()
+    assert not tmpdir.join("bootstrap/css/bootstrap.css").check()
+
+
+def test_extracts_resources_from_a_zipped_package(tmpdir):
+    package_dir = os.path.dirname(code_guide.__file__)
+    with zipfile.ZipFile(str(tmpdir.join("code_guide.zip")), "w") as z:
+        for d, dirs, files in os.walk(package_dir):
+            for f in files:
+                if not f.endswith(".pyc"):
+                    path = os.path.join(d, f)
+                    z.write(path, os.path.relpath(path, os.path.dirname(package_dir)))
+    
+    subprocess.check_call([sys.executable, "-c",
+                           "import sys; sys.path.insert(0, 'code_guide.zip'); import code_guide; "
+                           "code_guide.extract_resources_to('all'); code_guide.extract_resources_to('used', True)"],
+                          cwd=str(tmpdir))
+    
+    for r in scripts + stylesheets + ["jquery-1.9.1.js", "bootstrap/img/glyphicons-halflings.png"]:
+        assert tmpdir.join("all", r).check(file=1)
+    for r in scripts + stylesheets + ["bootstrap/img/glyphicons-halflings.png"]:
+        assert tmpdir.join("used", r).check(file=1)
+
+
+def test_does_not_extract_resources_that_are_up_to_date(tmpdir):
+    extract_resources_to(str(tmpdir))
+    
+    unchanged = tmpdir.join("bootstro.min.js")
+    changed = tmpdir.join("code-guide.js")
+    original_content = changed.read()
+    unchanged.setmtime(1000)
+    changed.write("corrupted")
+    
+    extract_resources_to(str(tmpdir))
+    
+    assert unchanged.mtime() == 1000
+    assert changed.read() == original_content
+
+
+def test_markdown_converters_are_reused_by_each_thread():
+    md = code_guide.markdown_converter(identity)
+    md.convert("[link][ref]\n\n[ref]: http://example.com")
+    
+    assert code_guide.markdown_converter(identity) is md
+    assert md.references == {}
+    assert code_guide.markdown_converter(re_subn("a", "b")) is not md
+
+
+guide_source = ["#|| A Guide", "#|| =======", "", "#| Prints [a value](value.html)", "print 1", "#|."]
+
+def test_renderer_renders_guides_as_to_html_does():
+    renderer = Renderer(syntax_highlight="python", resource_dir="res", link_transform_fn=re_subn("html$", "md"))
+    
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(guide_source), BufferedXMLGenerator(expected), syntax_highlight="python",
+            resource_dir="res", link_transform_fn=re_subn("html$", "md"))
+    
+    assert renderer.render(guide_source) == expected.getvalue()
+    
+    out = io.BytesIO()
+    renderer.render_to(guide_source, out)
+    assert out.getvalue() == expected.getvalue()
+
+
+def test_renderer_can_be_shared_between_threads():
+    renderer = Renderer()
+    expected = renderer.render(guide_source)
+    results = []
+    
+    def render():
+        for i in range(20):
+            results.append(renderer.render(guide_source))
+    
+    threads = [threading.Thread(target=render) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert results == [expected] * 80
+
+
+def test_renderer_rejects_unknown_options():
+    with pytest.raises(ValueError):
+        Renderer(resources="embedded")
+    with pytest.raises(pygments.util.ClassNotFound):
+        Renderer(syntax_highlight="no-such-language")
+
+
+fragmented_source = ["#|| A Guide", "#|| =======", "", "import os", "",
+                     "#| Lists the files", "for f in os.listdir('.'):", "    #| Prints each file", "    print f",
+                     "    #|.", "#|.", "", "#| Says goodbye", "print 'bye'", "#|.", "exit()"]
+
+def render_with_fragment_cache(source, fragment_cache, profile=None):
+    b = io.BytesIO()
+    to_html(lines_to_tagged_tree(source), BufferedXMLGenerator(b), fragment_cache=fragment_cache, profile=profile)
+    return b.getvalue()
+
+def test_guides_rendered_from_cached_fragments_are_the_same_as_guides_rendered_whole():
+    expected = io.BytesIO()
+    to_html(lines_to_tagged_tree(fragmented_source), BufferedXMLGenerator(expected))
+    
+    fragment_cache = FragmentCache()
+    
+    assert render_with_fragment_cache(fragmented_source, fragment_cache) == expected.getvalue()
+    assert render_with_fragment_cache(fragmented_source, fragment_cache) == expected.getvalue()
+
+
+def test_only_the_fragments_that_are_edited_are_rendered_again():
+    fragment_cache = FragmentCache()
+    first = Profile()
+    render_with_fragment_cache(fragmented_source, fragment_cache, first)
+    
+    edited = list(fragmented_source)
+    edited[12] = "#| Says goodbye politely"
+    edited[3:3] = ["# A new first line of code"]
+    again = Profile()
+    html = render_with_fragment_cache(edited, fragment_cache, again)
+    
+    assert first.counts["fragment cache misses"] == 5
+    assert again.counts["fragment cache misses"] == 2
+    assert again.counts["fragment cache hits"] == 3
+    assert "Says goodbye politely" in html
+
+
+def test_cached_fragments_can_be_written_to_any_content_handler():
+    fragment_cache = FragmentCache()
+    render_with_fragment_cache(fragmented_source, fragment_cache)
+    
+    handler = ElementTreeContentHandler()
+    to_html(lines_to_tagged_tree(fragmented_source), handler, fragment_cache=fragment_cache)
+    generated = XPathElementEvaluator(handler.etree.getroot())
+    
+    assert generated("string((//*[@data-bootstro-content])[2])") == "    print f\n"
+
+
+def test_fragments_of_compactly_highlighted_guides_cannot_be_cached():
+    with pytest.raises(ValueError):
+        to_html(lines_to_tagged_tree(fragmented_source), XMLGenerator(io.BytesIO()), compact_highlighting=True,
+                fragment_cache=FragmentCache())
+
+
+def test_polls_for_changed_files(tmpdir):
+    a = tmpdir.join("a.py")
+    a.write("a")
+    tmpdir.join("b.py").write("b")
+    
+    changes = [lambda: None, lambda: a.write("changed"), lambda: tmpdir.join("c.py").write("c")]
+    
+    def sleep(interval):
+        changes.pop(0)()
+    
+    changed = changed_files(lambda: [str(p) for p in tmpdir.listdir()], sleep=sleep)
+    
+    assert next(changed) == str(a)
+    assert next(changed) == str(tmpdir.join("c.py"))
+
+
+def test_watching_continues_after_a_watched_file_is_deleted(tmpdir, monkeypatch, capsys):
+    a = tmpdir.join("a.py")
+    b = tmpdir.join("b.py")
+    a.write("a = 1")
+    b.write("b = 1")
+    
+    def changed_files(paths, interval):
+        paths()
+        a.remove()
+        yield str(a)
+        b.write("converted_again = 2")
+        yield str(b)
+    
+    monkeypatch.setattr(code_guide, "changed_files", changed_files)
+    options = _conversion_options(comment_start="#", syntax_highlight="python", resource_dir="", link_transform_fn=identity)
+    
+    code_guide._watch(lambda: [(str(a), str(tmpdir.join("a.html"))), (str(b), str(tmpdir.join("b.html")))],
+                      options, None, 0)
+    
+    assert "cannot convert " + str(a) in capsys.readouterr()[1]
+    assert "converted_again" in tmpdir.join("b.html").read()
+
+
+def test_batch_sources_searches_directories_for_files_matched_by_output_transform(tmpdir):
+    tmpdir.join("a.py").write("a")
+    tmpdir.join("notes.txt").write("b")
+    tmpdir.mkdir("sub").join("c.py").write("c")
+    d = str(tmpdir)
+    
+    conversions = list(batch_sources([d], re_subn(r"\.py$", ".html")))
+    
+    assert conversions == [(d + "/a.py", d + "/a.html"), (d + "/sub/c.py", d + "/sub/c.html")]
+
+
+def test_converts_multiple_files_in_parallel(tmpdir):
+    for n in ["one", "two", "three"]:
+        tmpdir.join(n + ".py").write("#|| " + n.title() + "\n#|| ===\n\nprint " + repr(n) + "\n")
+    
+    conversions = [(str(tmpdir.join(n + ".py")), str(tmpdir.join("out", n + ".html"))) for n in ["one", "two", "three"]]
+    options = _conversion_options(comment_start="#", syntax_highlight="python", resource_dir="", 
+                                  link_transform_fn=re_subn(r"\.py$", ".html"))
+    
+    outputs = list(convert_files(conversions, options, jobs=2))
+    
+    assert sorted(outputs) == sorted(output for source, output in conversions)
+    for n in ["one", "two", "three"]:
+        generated = XPathElementEvaluator(lxml.etree.parse(str(tmpdir.join("out", n + ".html"))).getroot())
+        assert generated("string(/html/head/title)") == n.title()
+
+
+def test_profile_records_the_work_done_by_each_stage():
+    profile = Profile()
+    tree = lines_to_tagged_tree(["#|| Intro", "#| Region", "x = 1", "#|.", "y = 2"], profile=profile)
+    b = io.BytesIO()
+    to_html(tree, XMLGenerator(b), markdown_cache=MarkdownCache(), profile=profile)
+    
+    assert set(profile.times) == set(["parse", "render", "highlight", "markdown", "xhtml parsing", "write"])
+    assert profile.counts["lines"] == 2
+    assert profile.counts["regions"] == 1
+    assert profile.counts["markdown conversions"] == 2
+    assert profile.counts["bytes written"] == len(b.getvalue())
+
+
+def test_profile_records_the_bytes_written_by_a_buffered_generator_when_it_is_flushed():
+    profile = Profile()
+    b = io.BytesIO()
+    to_html(lines_to_tagged_tree(["x = 1"]), BufferedXMLGenerator(b), profile=profile)
+    
+    assert profile.counts["bytes written"] == len(b.getvalue())
+    assert "write" in profile.times
+
+
+def test_profile_is_reported_for_regions_and_json_exports(tmpdir, capsys):
+    source = tmpdir.join("example.py")
+    source.write("#| Region\nx = 1\n#|.\n")
+    
+    for options in [["--region-ordinal", "1"], ["--format", "json"]]:
+        cli(["code-guide", "--profile-format", "json"] + options + [str(source)])
+        
+        profile = json.loads(capsys.readouterr()[1])
+        assert profile["counts"]["lines"] == 1
+        assert profile["counts"]["bytes written"] > 0
+
+
+def test_streaming_with_a_step_table_is_rejected(tmpdir):
+    source = tmpdir.join("example.py")
+    source.write("#| Region\nx = 1\n#|.\n")
+    
+    with pytest.raises(SystemExit):
+        cli(["code-guide", "--stream", "--step-table", "-o", str(tmpdir.join("example.html")), str(source)])
+    
+    assert not tmpdir.join("example.html").check()
+
+
+def test_profiles_are_aggregated_across_processes(tmpdir):
+    for n in ["one", "two"]:
+        tmpdir.join(n + ".py").write("#|| " + n + "\n#| Explained\nprint 1\n#|.\n")
+    
+    conversions = [(str(tmpdir.join(n + ".py")), str(tmpdir.join(n + ".html"))) for n in ["one", "two"]]
+    options = _conversion_options(comment_start="#", syntax_highlight="python", resource_dir="", link_transform_fn=identity)
+    profile = Profile()
+    
+    list(convert_files(conversions, options, jobs=2, profile=profile))
+    
+    assert profile.counts["files"] == 2
+    assert profile.counts["lines"] == 2
+    assert profile.counts["regions"] == 2
+    assert profile.times["render"] > 0
+
+
+def test_buffered_output_is_the_same_as_unbuffered_output():
+    tree = lines_to_tagged_tree([u"#|| Intro", u"#| R\xe9gion", u"x = u'\u2603'", u"#|.", u"y = 2"])
+    unbuffered = io.BytesIO()
+    to_html(tree, XMLGenerator(unbuffered))
+    
+    for buffer_size in [1, 100, 64*1024]:
+        buffered = io.BytesIO()
+        to_html(tree, BufferedXMLGenerator(buffered, buffer_size=buffer_size))
+        assert buffered.getvalue() == unbuffered.getvalue()
+
+
+def test_output_file_is_only_replaced_when_completely_written(tmpdir):
+    f = tmpdir.join("out.html")
+    f.write("old")
+    
+    try:
+        with output_file(str(f)) as out:
+            out.write("partial")
+            raise MarkupError(1, "failed")
+    except MarkupError:
+        pass
+    
+    assert f.read() == "old"
+    assert tmpdir.listdir() == [f]
+    
+    with output_file(str(f)) as out:
+        out.write("new")
+    
+    assert f.read() == "new"
+    assert out.closed
+
+
+def test_detects_language_and_comment_syntax_from_file_name():
+    assert detect_language("examples/button-blink.py") == ("python", "#")
+    assert detect_language("Person.java") == ("java", "//")
+    assert detect_language("query.sql") == ("sql", "--")
+    assert detect_language("core.clj") == ("clojure", ";")
+    assert detect_language("Makefile") == ("make", "#")
+    assert detect_language("CMakeLists.txt") == ("cmake", "#")
+    assert detect_language("unknown.xyzzy") == ("python", "#")
+    assert detect_language(None) == ("python", "#")
+
+
+def test_given_language_and_comment_syntax_override_detection():
+    assert detect_language("Person.java", syntax_highlight="python") == ("python", "#")
+    assert detect_language("Person.java", comment_start="#") == ("java", "#")
+    assert detect_language("x", syntax_highlight="c++") == ("c++", "//")
+
+
+def test_converts_files_in_different_languages_in_one_run(tmpdir):
+    tmpdir.join("a.py").write("#| Python\nprint 1\n#|.\n")
+    tmpdir.join("B.java").write("//| Java\nclass B {}\n//|.\n")
+    
+    conversions = list(batch_sources([str(tmpdir)], re_subn(r"\.(py|java)$", ".html")))
+    options = _conversion_options(comment_start=None, syntax_highlight=None, resource_dir="", link_transform_fn=identity)
+    list(convert_files(conversions, options, jobs=1))
+    
+    for name, explanation in [("a.html", "Python"), ("B.html", "Java")]:
+        generated = XPathElementEvaluator(lxml.etree.parse(str(tmpdir.join(name))).getroot())
+        assert generated("count(//div[@class='bootstro'])") == 1
+        assert explanation in generated("string(//div[@class='bootstro']/@data-bootstro-content)")
+
+
 def code_to_html(tree, **kwargs):
     b = io.BytesIO()
     to_html(tree, XMLGenerator(b), **kwargs)
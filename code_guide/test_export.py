@@ -0,0 +1,59 @@
+import io
+import json
+import pytest
+from code_guide import MarkupError
+from code_guide.export import export_events, write_ndjson
+
+
+source = """#|| A guide
+
+#| [2] Sets up
+#| the lamp
+setup()
+#| [1] Blinks
+blink()
+#|.
+#|.
+#|| The end
+"""
+
+
+def test_exports_the_structure_of_a_guide_with_line_numbers():
+    assert list(export_events(source.splitlines())) == [
+        {"type": "intro", "text": "A guide", "lineno": 1, "end": 1},
+        {"type": "line", "text": "", "lineno": 2},
+        {"type": "start", "text": "Sets up\nthe lamp", "index": 2, "ordinal": 1, "depth": 0, "parent": None,
+         "lineno": 3, "end": 4},
+        {"type": "line", "text": "setup()", "lineno": 5},
+        {"type": "start", "text": "Blinks", "index": 1, "ordinal": 2, "depth": 1, "parent": 1,
+         "lineno": 6, "end": 6},
+        {"type": "line", "text": "blink()", "lineno": 7},
+        {"type": "end", "ordinal": 2, "lineno": 8},
+        {"type": "end", "ordinal": 1, "lineno": 9},
+        {"type": "outro", "text": "The end", "lineno": 10, "end": 10}]
+
+
+def test_can_render_explanations_from_markdown():
+    objects = list(export_events(["#| Blinks *fast*", "blink()", "#|."], markdown=True))
+
+    assert objects[0]["html"] == "<p>Blinks <em>fast</em></p>"
+    assert "html" not in objects[1]
+
+
+def test_reports_malformed_markup_after_exporting_what_came_before():
+    events = export_events(["#| Blinks", "blink()"])
+
+    assert next(events)["type"] == "start"
+    assert next(events)["type"] == "line"
+    with pytest.raises(MarkupError) as e:
+        next(events)
+    assert e.value.lineno == 1
+
+
+def test_writes_one_json_object_per_line():
+    out = io.BytesIO()
+    write_ndjson(export_events(source.splitlines()), out)
+
+    lines = out.getvalue().splitlines()
+    assert len(lines) == 9
+    assert json.loads(lines[2])["ordinal"] == 1
@@ -0,0 +1,95 @@
+import io
+import lxml.html
+import pytest
+from code_guide import lines_to_tagged_tree, region, BufferedXMLGenerator
+from code_guide import MarkupError
+from code_guide.regions import region_index, region_index_path, find_region, render_region, RegionNotFound
+
+
+source = """#|| A guide
+
+#| [2] Sets up
+setup()
+#| [1] Blinks
+blink()
+#|.
+#|.
+
+#| Cleans up
+cleanup()
+#|.
+"""
+
+
+def test_parser_records_the_regions_it_finds():
+    regions = []
+    lines_to_tagged_tree(source.splitlines(), regions=regions)
+
+    assert regions == [region(ordinal=1, index=2, text="Sets up", start=3, end=8, depth=0, parent=None),
+                       region(ordinal=2, index=1, text="Blinks", start=5, end=7, depth=1, parent=1),
+                       region(ordinal=3, index=None, text="Cleans up", start=10, end=12, depth=0, parent=None)]
+
+
+def render(path, n, by):
+    out = io.BytesIO()
+    render_region(path, n, by, out=BufferedXMLGenerator(out))
+    return lxml.html.fromstring(out.getvalue())
+
+
+def test_renders_a_region_within_the_regions_that_enclose_it(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write(source)
+
+    html = render(str(f), 1, "index")
+
+    assert html.get("class") == "code-guide-code"
+    assert [e.get("data-bootstro-content") for e in html.iter("div") if e.get("class") == "bootstro"] == \
+        ["<p>Sets up</p>", "<p>Blinks</p>"]
+    assert "blink()" in html.text_content()
+    assert "setup()" not in html.text_content()
+    assert "cleanup()" not in html.text_content()
+
+
+def test_renders_a_region_by_its_position_in_the_file(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write(source)
+
+    html = render(str(f), 3, "ordinal")
+
+    assert "cleanup()" in html.text_content()
+    assert "blink()" not in html.text_content()
+
+
+def test_region_index_is_kept_next_to_the_source_until_the_source_changes(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write(source)
+
+    index = region_index(str(f), "#")
+    assert tmpdir.join(".example.py.code-guide-regions").check()
+    assert region_index_path(str(f)) == str(tmpdir.join(".example.py.code-guide-regions"))
+    assert region_index(str(f), "#") == index
+
+    f.write("#| [1] Flashes\nflash()\n#|.\n")
+    f.setmtime(f.mtime() + 10)
+
+    assert find_region(region_index(str(f), "#"), 1)["text"] == "Flashes"
+    assert "flash()" in render(str(f), 1, "index").text_content()
+
+
+def test_unknown_regions_are_reported(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write(source)
+
+    with pytest.raises(RegionNotFound):
+        render_region(str(f), 7, "index")
+    with pytest.raises(RegionNotFound):
+        render_region(str(f), 4, "ordinal")
+
+
+def test_markup_errors_found_when_indexing_name_the_source(tmpdir):
+    f = tmpdir.join("example.py")
+    f.write("#| Unended\nx = 1\n")
+
+    with pytest.raises(MarkupError) as e:
+        render_region(str(f), 1, "ordinal")
+    assert str(e.value) == str(f) + ":1: region is not ended"
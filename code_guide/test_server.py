@@ -0,0 +1,162 @@
+import io
+import gzip
+import threading
+import httplib
+import pytest
+from collections import OrderedDict
+import code_guide.server as server_module
+from code_guide.server import GuideServer, GuideRenderer
+
+
+@pytest.fixture
+def server(tmpdir):
+    tmpdir.join("example.py").write("#|| An example\nprint 1\n")
+    tmpdir.join("sub").mkdir()
+    tmpdir.join("sub", "other.py").write("print 2\n")
+
+    s = GuideServer(("127.0.0.1", 0), str(tmpdir), GuideRenderer(), threads=2)
+    t = threading.Thread(target=s.serve_forever)
+    t.daemon = True
+    t.start()
+    yield s
+    s.shutdown()
+    s.server_close()
+
+
+def get(server, path, **headers):
+    conn = httplib.HTTPConnection("127.0.0.1", server.server_address[1])
+    try:
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def test_renders_source_files_as_guides(server):
+    status, headers, body = get(server, "/example.py")
+
+    assert status == 200
+    assert headers["content-type"] == "text/html"
+    assert "An example" in body
+    assert '/_code_guide/bootstrap/css/bootstrap.min.css' in body
+
+
+def test_serves_resources_from_the_package(server):
+    status, headers, body = get(server, "/_code_guide/code-guide.css")
+
+    assert status == 200
+    assert headers["content-type"] == "text/css"
+
+
+def test_unchanged_pages_are_not_sent_again(server):
+    status, headers, body = get(server, "/example.py")
+
+    status, _, body = get(server, "/example.py", **{"If-None-Match": headers["etag"]})
+
+    assert status == 304
+    assert body == ""
+
+
+def test_pages_are_rendered_again_when_source_changes(server, tmpdir):
+    _, headers, _ = get(server, "/example.py")
+
+    tmpdir.join("example.py").write("#|| A changed example\nprint 1\n")
+    status, headers2, body = get(server, "/example.py", **{"If-None-Match": headers["etag"]})
+
+    assert status == 200
+    assert headers2["etag"] != headers["etag"]
+    assert "A changed example" in body
+
+
+def test_pages_are_compressed_if_client_accepts_gzip(server):
+    _, _, plain = get(server, "/example.py")
+    status, headers, body = get(server, "/example.py", **{"Accept-Encoding": "gzip, deflate"})
+
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert gzip.GzipFile(fileobj=io.BytesIO(body)).read() == plain
+
+
+def test_compressed_and_uncompressed_pages_have_different_etags(server):
+    _, plain_headers, _ = get(server, "/example.py")
+    _, gzip_headers, _ = get(server, "/example.py", **{"Accept-Encoding": "gzip"})
+    
+    assert gzip_headers["etag"] != plain_headers["etag"]
+    assert get(server, "/example.py", **{"Accept-Encoding": "gzip", "If-None-Match": gzip_headers["etag"]})[0] == 304
+    assert get(server, "/example.py", **{"Accept-Encoding": "gzip", "If-None-Match": plain_headers["etag"]})[0] == 200
+    assert get(server, "/example.py", **{"If-None-Match": gzip_headers["etag"]})[0] == 200
+
+
+def test_pages_are_only_compressed_if_gzip_is_acceptable():
+    for accept_encoding, gzipped in [("gzip", True), ("deflate, gzip;q=0.5", True), ("GZIP", True), ("x-gzip", True),
+                                     ("*", True), ("gzip;q=0", False), ("gzip; q=0.0, deflate", False),
+                                     ("x-gzip-foo", False), ("deflate", False), ("*, gzip;q=0", False), ("", False)]:
+        assert server_module._accepts_gzip(accept_encoding) == gzipped, accept_encoding
+
+
+def test_least_recently_used_compressed_bodies_are_discarded(monkeypatch):
+    monkeypatch.setattr(server_module, "_gzipped_bodies", OrderedDict())
+    monkeypatch.setattr(server_module, "_gzipped_bodies_max_entries", 2)
+    a, b, c = [server_module._page_of("text/html", body) for body in ["a", "b", "c"]]
+    
+    server_module._gzipped(a)
+    server_module._gzipped(b)
+    server_module._gzipped(a)
+    server_module._gzipped(c)
+    
+    assert server_module._gzipped_bodies.keys() == [a.etag, c.etag]
+
+
+def test_directories_are_listed(server):
+    status, _, body = get(server, "/")
+
+    assert status == 200
+    assert 'href="example.py"' in body
+    assert 'href="sub/"' in body
+
+
+def test_files_outside_root_are_not_served(server):
+    assert get(server, "/../etc/passwd")[0] == 404
+    assert get(server, "/_code_guide/../server.py")[0] == 404
+    assert get(server, "/_code_guide/__init__.py")[0] == 404
+    assert get(server, "/missing.py")[0] == 404
+
+
+def test_renderer_only_renders_files_again_if_their_content_changes(tmpdir):
+    renders = []
+
+    class CountingRenderer(GuideRenderer):
+        def render(self, source, path=None):
+            renders.append(source)
+            return GuideRenderer.render(self, source, path)
+
+    renderer = CountingRenderer()
+    f = tmpdir.join("example.py")
+    f.write("print 1\n")
+
+    page = renderer.page(str(f))
+    assert renderer.page(str(f)) is page
+
+    f.setmtime(f.mtime() + 10)
+    assert renderer.page(str(f)) is page
+
+    f.write("print 2\n")
+    assert renderer.page(str(f)) is not page
+
+    assert renders == ["print 1\n", "print 2\n"]
+
+
+def test_renderer_discards_the_least_recently_used_pages(tmpdir):
+    renderer = GuideRenderer(max_entries=2)
+    a, b, c = [str(tmpdir.join(n + ".py")) for n in "abc"]
+    for path in [a, b, c]:
+        with open(path, "w") as f:
+            f.write("print 1\n")
+    
+    renderer.page(a)
+    renderer.page(b)
+    renderer.page(a)
+    renderer.page(c)
+    
+    assert renderer._renderings.keys() == [a, c]
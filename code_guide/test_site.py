@@ -0,0 +1,94 @@
+import json
+import lxml.etree
+from lxml.etree import XPathElementEvaluator
+from code_guide.site import update_site, index_guide, search_index, words
+
+
+def test_indexes_title_intro_and_explanations_of_a_guide():
+    guide = index_guide(["#|| Blinking Lights",
+                         "#|| ===============",
+                         "#||",
+                         "#|| How to *blink* an LED.",
+                         "",
+                         "#| Toggles the GPIO pin",
+                         "toggle(pin)",
+                         "#|."])
+
+    assert guide["title"] == "Blinking Lights"
+    assert guide["summary"] == "How to blink an LED."
+    assert set(["blinking", "lights", "blink", "led", "toggles", "gpio", "pin"]) <= set(guide["words"])
+    assert "toggle" not in guide["words"]
+    assert "to" not in guide["words"]
+
+
+def test_search_index_maps_words_to_guides():
+    index = search_index([{"url": "a.html", "title": "A", "words": ["blink", "led"]},
+                          {"url": "b.html", "title": None, "words": ["led"]}])
+
+    assert index == {"guides": [["a.html", "A"], ["b.html", "b.html"]],
+                     "words": {"blink": [0], "led": [0, 1]}}
+
+
+def test_words_are_lowercased_and_common_words_ignored():
+    assert words("The GPIO pin_number is 3, a number") == set(["gpio", "pin_number", "number"])
+
+
+def write_sources(tmpdir):
+    tmpdir.join("src", "b.py").write("#|| Bravo\n#|| =====\n\n#| Flashes the lamp\nflash()\n#|.\n", ensure=True)
+    tmpdir.join("src", "A.java").write("//|| Alpha\n//|| =====\n\n//| Reads the switch\nread();\n//|.\n")
+    return [(str(tmpdir.join("src", n)), str(tmpdir.join("site", "guides", n.split(".")[0] + ".html")))
+            for n in ["b.py", "A.java"]]
+
+
+def test_writes_an_index_page_that_links_to_every_guide(tmpdir):
+    conversions = write_sources(tmpdir)
+
+    update_site(str(tmpdir.join("site", "index.html")), conversions)
+
+    page = XPathElementEvaluator(lxml.etree.parse(str(tmpdir.join("site", "index.html"))).getroot())
+    assert page("//ul[@class='code-guide-index']/li/a/@href") == ["guides/A.html", "guides/b.html"]
+    assert page("//ul[@class='code-guide-index']/li/a/text()") == ["Alpha", "Bravo"]
+    assert page("//input/@data-search-index") == ["search-index.json"]
+
+    index = json.loads(tmpdir.join("site", "search-index.json").read())
+    assert index["words"]["switch"] == [0]
+    assert index["words"]["lamp"] == [1]
+
+
+def test_only_changed_guides_are_indexed_again(tmpdir):
+    conversions = write_sources(tmpdir)
+    index_path = str(tmpdir.join("site", "index.html"))
+
+    assert sorted(update_site(index_path, conversions)) == sorted(source for source, output in conversions)
+    assert update_site(index_path, conversions) == []
+
+    tmpdir.join("src", "b.py").write("#|| Bravo\n#|| =====\n\n#| Dims the lamp\ndim()\n#|.\n")
+    assert update_site(index_path, conversions) == [str(tmpdir.join("src", "b.py"))]
+
+    index = json.loads(tmpdir.join("site", "search-index.json").read())
+    assert "dims" in index["words"]
+    assert "flashes" not in index["words"]
+
+
+def test_removed_guides_are_removed_from_index(tmpdir):
+    conversions = write_sources(tmpdir)
+    index_path = str(tmpdir.join("site", "index.html"))
+
+    update_site(index_path, conversions)
+    update_site(index_path, conversions[:1])
+
+    index = json.loads(tmpdir.join("site", "search-index.json").read())
+    assert index["guides"] == [["guides/b.html", "Bravo"]]
+    assert "switch" not in index["words"]
+
+
+def test_guides_are_indexed_with_the_comment_syntax_of_the_given_language(tmpdir):
+    tmpdir.join("src", "c.txt").write("//|| Charlie\n//|| =======\n\n//| Turns the dial\nturn();\n//|.\n", ensure=True)
+    conversions = [(str(tmpdir.join("src", "c.txt")), str(tmpdir.join("site", "c.html")))]
+    index_path = str(tmpdir.join("site", "index.html"))
+
+    update_site(index_path, conversions, syntax_highlight="java")
+
+    index = json.loads(tmpdir.join("site", "search-index.json").read())
+    assert index["guides"] == [["c.html", "Charlie"]]
+    assert "dial" in index["words"]
@@ -41,4 +41,5 @@ with button, led:
         #| [3] Sleep a bit before the next iteration, so that the LED
         #| blinks on and off once per second.
         sleep(0.5)
+        #|.
     #|.
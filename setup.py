@@ -4,11 +4,15 @@ from setuptools import setup
 from setuptools.command.test import test as TestCommand
 import sys
 import os
+import re
 import subprocess
 
 def contents_of(fname):
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
 
+def version():
+    return re.search(r'^__version__ = "(.+)"$', contents_of('code_guide/__init__.py'), re.M).group(1)
+
     
 class PyTest(TestCommand):
     def finalize_options(self):
@@ -24,7 +28,7 @@ class PyTest(TestCommand):
 
 
 setup(name='code-guide',
-      version="1.0.2",
+      version=version(),
       description='Turn example code into interactive HTML documentation',
       long_description=contents_of('README'),
       author='Nat Pryce',